@@ -0,0 +1,212 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import signal
+import sqlite3
+import sys
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+import db
+from async_data import AsyncData, Overloaded
+from timestamps import is_valid_datetime
+from workouts import HISTORY_PAGE_SIZE
+
+# Local read-only HTTP API for leaderboards, workout history and predictions (JSON over HTTP/1.1)
+#   GET /leaderboard?student_id=&exercise=&limit=10&offset=0
+#   GET /history?student_id=&after=&limit=200   (oldest first, after is "datetime,id" of the last workout already received)
+#   GET /prediction?student_id=&exercise=&level=intermediate&degree=2
+# Data access goes through async_data.AsyncData (bounded thread and process pools, coalescing, backpressure),
+# a request that can't be queued gets 503 with Retry-After
+# Responses are cached and carry an ETag made from the database's watermark (PRAGMA data_version, which moves
+# whenever anyone commits to the file) so a client sending If-None-Match gets a 304 while nothing has changed
+# Bodies are gzipped for clients that accept it and connections are kept alive between requests
+# Usage: python api_server.py [port] [host]
+
+HOST = "127.0.0.1"
+PORT = 8000
+KEEP_ALIVE_TIMEOUT = 15 # seconds an idle connection is kept open
+MAX_CACHED = 1024 # responses kept in the cache
+GZIP_MIN_BYTES = 512 # smaller bodies aren't worth compressing
+MAX_LIMIT = 100 # largest leaderboard page
+MAX_HISTORY_LIMIT = 1000 # largest history page
+
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _int(params, name, default=None, low=None, high=None):
+    value = params.get(name, [None])[0]
+    if value in (None, ""):
+        if default is None:
+            raise ApiError(400, f"{name} is required")
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"{name} must be a whole number") from None
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ApiError(400, f"{name} must be between {low} and {high}")
+    return value
+
+
+def _text(params, name, default=None):
+    value = params.get(name, [default])[0]
+    if value is None:
+        raise ApiError(400, f"{name} is required")
+    return value
+
+
+def _after(params):
+    # The keyset cursor for /history: "datetime,id" of the last workout on the previous page, or None for the first page
+    value = params.get("after", [""])[0]
+    if not value:
+        return None
+    date, _, workout_id = value.rpartition(",")
+    if not is_valid_datetime(date) or not workout_id.isdigit():
+        raise ApiError(400, "after must be the datetime and id of a workout, as YYYY-MM-DD HH:MM:SS,id")
+    return date, int(workout_id)
+
+
+class ApiServer:
+    def __init__(self, data=None):
+        self.data = data or AsyncData()
+        self.cache = OrderedDict() # (path, sorted query) -> (watermark, etag, body, gzipped body or None)
+        self.token = os.urandom(4).hex() # data_version starts again with every connection, so ETags name the server run
+        # one connection only used for the watermark, data_version is per connection so it must always be the same one
+        self.version_conn = sqlite3.connect(f"file:{db.DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+        self.routes = {"/leaderboard": self.leaderboard, "/history": self.history, "/prediction": self.prediction}
+
+    def watermark(self):
+        # A few microseconds (no table is read), so it runs on the event loop
+        return self.version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    async def leaderboard(self, params):
+        student_id = _int(params, "student_id", 0) or None
+        rows = await self.data.show_leaderboard(student_id, params.get("exercise", [None])[0], _int(params, "limit", 10, 1, MAX_LIMIT), _int(params, "offset", 0, 0))
+        return [{"student_id": s, "name": name, "exercise": exercise, "rate": rate} for s, name, exercise, rate in rows]
+
+    async def history(self, params):
+        # keyset pages from idx_workouts_history, so a long history is never sent (or read) in one go
+        rows = await self.data.get_workout_page(_int(params, "student_id"), _after(params), _int(params, "limit", HISTORY_PAGE_SIZE, 1, MAX_HISTORY_LIMIT))
+        return [{"id": workout_id, "datetime": date, "exercise": exercise, "reps": reps, "weight": weight, "is_bodyweight": bool(is_bodyweight)}
+                for workout_id, date, exercise, reps, weight, is_bodyweight in rows]
+
+    async def prediction(self, params):
+        student_id, exercise = _int(params, "student_id"), _text(params, "exercise").lower()
+        level = _text(params, "level", "intermediate")
+        result = await self.data.predict(student_id, exercise, level, _int(params, "degree", 2, 1, 5))
+        if not result:
+            raise ApiError(404, "not enough workouts for a prediction")
+        # solved from the running sums, the workout days themselves aren't read (GET /history has them)
+        _, future_days, future_reps, future_weights, reps_ci, weights_ci, level = result
+        return {
+            "student_id": student_id, "exercise": exercise, "level": level,
+            "future_days": [int(d) for d in future_days.ravel()],
+            "future_reps": [float(r) for r in future_reps], "future_weights": [float(w) for w in future_weights],
+            "reps_ci": float(reps_ci), "weights_ci": float(weights_ci),
+        }
+
+    async def respond(self, method, target, headers):
+        # Returns (status, extra headers, body)
+        if method not in ("GET", "HEAD"):
+            raise ApiError(405, "only GET and HEAD are supported")
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            raise ApiError(404, f"no endpoint {url.path}")
+        params = parse_qs(url.query)
+        key = (url.path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+        watermark = self.watermark()
+        cached = self.cache.get(key)
+        if cached is None or cached[0] != watermark:
+            body = json.dumps(await handler(params), separators=(",", ":")).encode()
+            etag = '"' + hashlib.sha1(f"{self.token}|{watermark}|{key}".encode()).hexdigest()[:20] + '"'
+            cached = (watermark, etag, body, gzip.compress(body, 5) if len(body) >= GZIP_MIN_BYTES else None)
+            self.cache[key] = cached
+            if len(self.cache) > MAX_CACHED:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(key)
+        _, etag, body, gzipped = cached
+        extra = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]:
+            return 304, extra, b""
+        if gzipped is not None and "gzip" in headers.get("accept-encoding", ""):
+            extra["Content-Encoding"] = "gzip"
+            body = gzipped
+        return 200, extra, body
+
+    async def handle(self, reader, writer):
+        # One client connection, requests are answered in order until the client closes it or goes idle
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0) or 0):
+                    await reader.readexactly(int(headers["content-length"])) # no endpoint takes a body
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                try:
+                    status, extra, body = await self.respond(method, target, headers)
+                except ApiError as e:
+                    status, extra, body = e.status, {}, json.dumps({"error": str(e)}).encode()
+                except Overloaded as e:
+                    status, extra, body = 503, {"Retry-After": "1"}, json.dumps({"error": str(e)}).encode()
+                except Exception as e: # a bug or a database error, the client still gets an answer and the connection stays usable
+                    # the details only go to the server's log, they can name tables, files or SQL
+                    print(f"error handling {method} {target}: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
+                    status, extra, body = 500, {}, json.dumps({"error": "internal server error"}).encode()
+                extra.update({"Content-Type": "application/json", "Content-Length": str(len(body)), "Connection": "keep-alive" if keep_alive else "close"})
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\n" + "".join(f"{name}: {value}\r\n" for name, value in extra.items()) + "\r\n"
+                writer.write(head.encode("latin-1") + (b"" if method == "HEAD" else body))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass # idle, gone or not speaking HTTP
+        finally:
+            writer.close()
+
+    def close(self):
+        self.data.close()
+        self.version_conn.close()
+
+
+async def serve(host=HOST, port=PORT):
+    db.get_connection() # brings the schema up to date before everything switches to read-only connections
+    db.configure(read_only=True)
+    api = ApiServer()
+    server = await asyncio.start_server(api.handle, host, port)
+    print(f"serving on http://{host}:{server.sockets[0].getsockname()[1]}", flush=True)
+    # SIGTERM stops the server like Ctrl+C so the worker processes are shut down too
+    serving = asyncio.current_task()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        api.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(sys.argv[2] if len(sys.argv) > 2 else HOST, int(sys.argv[1]) if len(sys.argv) > 1 else PORT))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import db
+import database
+import predictor
+import workouts
+from parallel_forecast import _init_worker, _forecast_unit
+
+# asyncio front for the blocking data functions, for a server that answers many students at once
+# - SQLite work runs on a small thread pool; db.py gives every thread its own connection, so a connection
+#   is only ever used by the thread that opened it and at most DB_WORKERS connections are open
+# - forecasting (predict_targets, predict_targets_from_stats) runs in a process pool so it doesn't hold the GIL the event loop needs,
+#   the worker processes read the database themselves through read-only connections
+# - at most MAX_PENDING calls are queued or running, a call that can't get a slot within QUEUE_TIMEOUT
+#   seconds raises Overloaded instead of piling up more work
+# - identical calls made while one is still running share its result instead of running again
+# Usage: python async_data.py [concurrent requests]   (small demo against fitness.db)
+
+DB_WORKERS = 4
+CPU_WORKERS = os.cpu_count() or 1
+MAX_PENDING = 64
+QUEUE_TIMEOUT = 5.0 # seconds
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AsyncData:
+    def __init__(self, db_workers=DB_WORKERS, cpu_workers=CPU_WORKERS, max_pending=MAX_PENDING, queue_timeout=QUEUE_TIMEOUT):
+        self.db_executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="db")
+        self.cpu_executor = ProcessPoolExecutor(max_workers=cpu_workers, initializer=_init_worker, initargs=(db.DB_PATH,))
+        self.max_pending = max_pending
+        self.slots = asyncio.Semaphore(max_pending)
+        self.queue_timeout = queue_timeout
+        self.in_flight = {} # call key -> future shared by everyone waiting on that call
+        self.stats = {"executed": 0, "coalesced": 0, "rejected": 0}
+
+    async def _run(self, key, executor, function, *args):
+        # Runs function(*args) on executor, or joins the identical call already running (key None: never shared)
+        if key is not None and key in self.in_flight:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.in_flight[key]) # one caller giving up doesn't cancel it for the rest
+        # registered before anything is awaited so identical calls made meanwhile find it
+        task = asyncio.ensure_future(self._execute(executor, function, args))
+        if key is not None:
+            self.in_flight[key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _execute(self, executor, function, args):
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise Overloaded(f"all {self.max_pending} slots were busy for {self.queue_timeout}s") from None
+        self.stats["executed"] += 1
+        future = asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        # the slot is freed when the work finishes, even if every caller waiting on it was cancelled
+        future.add_done_callback(lambda _: self.slots.release())
+        return await future
+
+    async def get_workout_data(self, student_id, exercise):
+        # (datetime64 dates, reps, weights) like predictor.get_workout_data
+        return await self._run(("workout_data", student_id, exercise), self.db_executor, predictor.get_workout_data, student_id, exercise)
+
+    async def get_workout_history(self, student_id):
+        return await self._run(("history", student_id), self.db_executor, database.get_workout_history, student_id)
+
+    async def get_workout_page(self, student_id, after=None, limit=workouts.HISTORY_PAGE_SIZE):
+        # One keyset page of the history like workouts.get_workout_page, after is (datetime, id) or None
+        return await self._run(("history_page", student_id, after, limit), self.db_executor, workouts.get_workout_page, student_id, after, limit)
+
+    async def show_leaderboard(self, student_id=None, exercise_filter=None, limit=10, offset=0):
+        key = ("leaderboard", student_id, exercise_filter, limit, offset)
+        return await self._run(key, self.db_executor, predictor.show_leaderboard, student_id, exercise_filter, limit, offset)
+
+    async def predict_targets(self, dates, reps, weights, user_level="intermediate", degree=2):
+        # Fits data the caller already has in a worker process (arrays aren't hashable so this is never shared)
+        return await self._run(None, self.cpu_executor, predictor.predict_targets, dates, reps, weights, user_level, degree)
+
+    async def predict(self, student_id, exercise, user_level="intermediate", degree=2):
+        # Forecasts a student's series in a worker process from the workout_stats sums (predictor.predict_targets_from_stats)
+        key = ("predict", student_id, exercise, user_level, degree)
+        return await self._run(key, self.cpu_executor, _forecast_unit, student_id, exercise, user_level, degree, False)
+
+    def close(self):
+        self.db_executor.shutdown(wait=True)
+        self.cpu_executor.shutdown(wait=True, cancel_futures=True)
+        db.close_all() # the pool threads' connections
+
+
+async def _demo(requests):
+    data = AsyncData()
+    try:
+        start = time.perf_counter()
+        # the same leaderboard asked for by many students at once, plus a history and a prediction each
+        users = [row[0] for row in db.get_connection().execute("SELECT student_id FROM users ORDER BY student_id LIMIT ?", (requests,))]
+        calls = [data.show_leaderboard() for _ in range(requests)]
+        calls += [data.get_workout_history(student_id) for student_id in users]
+        calls += [data.predict(student_id, "pushups") for student_id in users]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        errors = sum(isinstance(result, Exception) for result in results)
+        print(f"{len(calls)} calls in {time.perf_counter() - start:.2f}s, {errors} errors, {data.stats}")
+    finally:
+        data.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_demo(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
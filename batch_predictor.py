@@ -0,0 +1,132 @@
+import sys
+import time
+import numpy as np
+from db import get_connection, transaction
+from predictor import apply_training_rules, reached_next_level
+from timestamps import now_text
+
+# Forecasts for every student and exercise in a single pass over user_workouts (for the nightly coaching report)
+# Rows are streamed in (student_id, exercise, datetime) order straight from idx_workouts_series, cut into
+# contiguous arrays per series and all the series in a chunk are fitted together with batched NumPy operations
+# The results go into the predictions table (one row per series per future day)
+# Usage: python batch_predictor.py [user level]
+
+FETCH_SIZE = 50000 # rows fetched from sqlite at a time
+HORIZON = 5 # number of future days to predict, the same as predict_targets
+
+# the epoch seconds in ts are read from idx_workouts_series so no date string is parsed at all
+SERIES_QUERY = """
+    SELECT student_id, exercise, ts, reps, weight
+    FROM user_workouts ORDER BY student_id, exercise, datetime
+"""
+
+
+def iter_series_chunks(fetch_size=FETCH_SIZE):
+    # Yields (keys, starts, seconds, reps, weights) for groups of complete series
+    # keys[i] is the (student_id, exercise) of the series that begins at index starts[i] of the arrays
+    # A series that is cut off at the end of a fetch is carried over and finished by the next fetch
+    cursor = get_connection().execute(SERIES_QUERY)
+    carry = None
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if rows:
+            student_ids, exercises, seconds, reps, weights = zip(*rows)
+            columns = [np.array(student_ids, dtype=np.int64), np.array(exercises, dtype=object), np.array(seconds, dtype=np.int64), np.array(reps, dtype=float), np.array(weights, dtype=float)]
+            if carry is not None:
+                columns = [np.concatenate([old, new]) for old, new in zip(carry, columns)]
+        elif carry is not None:
+            columns = carry
+        else:
+            return
+        student_ids, exercises = columns[0], columns[1]
+        # a new series starts wherever the student or the exercise changes
+        starts = np.concatenate([[0], np.flatnonzero((student_ids[1:] != student_ids[:-1]) | (exercises[1:] != exercises[:-1])) + 1])
+        if rows:
+            # the last series might continue in the next fetch so it waits for that
+            cut = starts[-1]
+            carry = [column[cut:] for column in columns]
+            starts = starts[:-1]
+            columns = [column[:cut] for column in columns]
+            if len(starts) == 0:
+                continue
+        else:
+            carry = None
+        keys = list(zip(student_ids[starts].tolist(), exercises[starts].tolist()))
+        yield keys, starts, columns[2], columns[3], columns[4]
+        if not rows:
+            return
+
+
+def fit_series(days, values, starts, degree=2):
+    # Fits a polynomial to every series at once by solving each series' normal equations in one batched call
+    # days and values hold all the series back to back, values has one column per target (reps, weights)
+    # Returns (coeffs with shape (series, degree+1, targets), scale per series); the coefficients are for days / scale
+    lengths = np.diff(np.append(starts, len(days)))
+    # days are scaled to [0, 1] per series to keep the normal equations well conditioned
+    scale = np.maximum(np.maximum.reduceat(days, starts), 1.0)
+    x = days / np.repeat(scale, lengths)
+    powers = x[:, None] ** np.arange(2 * degree + 1)
+    sums = np.add.reduceat(powers, starts, axis=0) # sum of x^k for every series
+    index = np.arange(degree + 1)
+    XT_X = sums[:, index[:, None] + index[None, :]]
+    XT_y = np.add.reduceat(powers[:, :degree + 1, None] * values[:, None, :], starts, axis=0)
+    # pinv gives the least squares answer for singular systems too (e.g. every workout on the same day)
+    coeffs = np.linalg.pinv(XT_X, rcond=1e-12) @ XT_y
+    return coeffs, scale
+
+
+def forecast_chunk(starts, seconds, reps, weights, user_level="intermediate", degree=2, horizon=HORIZON):
+    # Same forecast as predict_targets for every series in the chunk
+    # Returns (mask of series that had enough data, future_days, future_reps, future_weights, reps_ci, weights_ci, levels)
+    lengths = np.diff(np.append(starts, len(seconds)))
+    ends = starts + lengths - 1
+    # whole days since each series' first workout, the same as (d - dates[0]).days
+    days = ((seconds - np.repeat(seconds[starts], lengths)) // 86400).astype(float)
+    coeffs, scale = fit_series(days, np.column_stack([reps, weights]), starts, degree)
+
+    future_days = days[ends][:, None] + np.arange(1, horizon + 1)
+    x = future_days / scale[:, None]
+    future = (x[:, :, None] ** np.arange(degree + 1)) @ coeffs # (series, days, targets)
+    future_reps, future_weights = apply_training_rules(future[:, :, 0], future[:, :, 1], reps[ends], weights[ends], user_level)
+
+    levels = np.where(reached_next_level(reps[ends], weights[ends], user_level), "expert", user_level)
+    # 95% confidence intervals worked out the same way as predict_targets
+    reps_ci = 1.96 * (np.maximum.reduceat(reps, starts) - np.minimum.reduceat(reps, starts)) / lengths
+    weights_ci = 1.96 * (np.maximum.reduceat(weights, starts) - np.minimum.reduceat(weights, starts)) / lengths
+    # less than 2 workouts is not enough data to make an accurate prediction
+    return lengths >= 2, future_days.astype(int), future_reps, future_weights, reps_ci, weights_ci, levels
+
+
+def predict_all(user_level="intermediate", degree=2, horizon=HORIZON, fetch_size=FETCH_SIZE):
+    # Forecasts every (student_id, exercise) series and replaces the contents of the predictions table
+    # Returns the number of series that were forecast
+    run_time = now_text()
+    total = 0
+    for keys, starts, seconds, reps, weights in iter_series_chunks(fetch_size):
+        enough, future_days, future_reps, future_weights, reps_ci, weights_ci, levels = forecast_chunk(starts, seconds, reps, weights, user_level, degree, horizon)
+        rows = []
+        for s in np.flatnonzero(enough):
+            student_id, exercise = keys[s]
+            for d in range(horizon):
+                rows.append((student_id, exercise, int(future_days[s, d]), float(future_reps[s, d]), float(future_weights[s, d]), float(reps_ci[s]), float(weights_ci[s]), str(levels[s]), run_time))
+        with transaction() as conn:
+            conn.executemany("DELETE FROM predictions WHERE student_id = ? AND exercise = ?", keys)
+            conn.executemany("INSERT INTO predictions (student_id, exercise, day, reps, weight, reps_ci, weights_ci, user_level, generated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        total += int(enough.sum())
+    # anything not written by this run belongs to series that no longer have enough workouts
+    with transaction() as conn:
+        conn.execute("DELETE FROM predictions WHERE generated_at <> ?", (run_time,))
+    return total
+
+
+def get_saved_predictions(student_id, exercise):
+    # Reads the stored forecast for one series as (day, reps, weight, reps_ci, weights_ci, user_level) rows
+    cursor = get_connection().execute("SELECT day, reps, weight, reps_ci, weights_ci, user_level FROM predictions WHERE student_id = ? AND exercise = ? ORDER BY day", (student_id, exercise.lower()))
+    return cursor.fetchall()
+
+
+if __name__ == "__main__":
+    level = sys.argv[1] if len(sys.argv) > 1 else "intermediate"
+    start = time.perf_counter()
+    count = predict_all(level)
+    print(f"forecast {count} series in {time.perf_counter() - start:.2f}s")
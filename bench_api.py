@@ -0,0 +1,96 @@
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import db
+import workouts
+
+# Load test for api_server.py: p50/p99 latency and requests/sec for a mix of leaderboard, history and
+# prediction requests from several keep-alive clients
+# Seeds a throwaway database and runs the server on it in a separate process so fitness.db is never touched
+# Runs twice: plain requests, then clients revalidating with If-None-Match (304s from the ETag cache)
+# Usage: python bench_api.py [clients] [seconds per run] [students]
+
+clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+students = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+path = os.path.join(tempfile.mkdtemp(), "bench.db")
+db.configure(path)
+random.seed(0)
+with db.transaction() as conn:
+    conn.executemany("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", [(1000 + s, f"student{s}", "password") for s in range(students)])
+rows = []
+for s in range(students):
+    for exercise in random.sample(workouts.valid_exercises, 4):
+        for i in range(100):
+            rows.append((1000 + s, exercise, random.randint(5, 120), float(random.choice([0, 10, 20, 40, 60])), 0, f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:00:00"))
+workouts.add_workouts_bulk(rows)
+series = db.get_connection().execute("SELECT DISTINCT student_id, exercise FROM user_workouts").fetchall()
+db.close_all()
+
+with socket.socket() as s: # a free port for the server
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+server = subprocess.Popen([sys.executable, "api_server.py", str(port)], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          env={**os.environ, "FITNESS_DB": path}, stdout=subprocess.PIPE, text=True)
+server.stdout.readline() # "serving on ..."
+
+
+def request_path(rng):
+    kind = rng.random()
+    if kind < 0.4:
+        return f"/leaderboard?limit=10&offset={rng.choice([0, 10, 20])}"
+    student_id, exercise = rng.choice(series)
+    if kind < 0.7:
+        return f"/history?student_id={student_id}"
+    return f"/prediction?student_id={student_id}&exercise={exercise.replace(' ', '%20')}"
+
+
+def client(number, revalidate, deadline, latencies, statuses):
+    rng = random.Random(number)
+    conn = http.client.HTTPConnection("127.0.0.1", port) # HTTP/1.1, the connection is reused for every request
+    etags = {}
+    while time.perf_counter() < deadline:
+        url = request_path(rng)
+        headers = {"Accept-Encoding": "gzip"}
+        if revalidate and url in etags:
+            headers["If-None-Match"] = etags[url]
+        start = time.perf_counter()
+        conn.request("GET", url, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.getheader("ETag"):
+            etags[url] = response.getheader("ETag")
+    conn.close()
+
+
+def run(revalidate):
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(i, revalidate, deadline, latencies, statuses)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{'revalidating' if revalidate else 'plain':>12}: {len(latencies) / elapsed:8,.0f} req/s  p50 {p50 * 1000:6.2f} ms  p99 {p99 * 1000:6.2f} ms  statuses {dict(sorted(statuses.items()))}")
+
+
+try:
+    print(f"{clients} clients, {seconds:g}s per run, {len(rows):,} workouts in {len(series)} series")
+    run(False)
+    run(True)
+finally:
+    server.terminate()
+    server.wait()
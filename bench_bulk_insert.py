@@ -0,0 +1,38 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import db
+import workouts
+
+# Benchmark: rows/sec for workouts.add_workout (one transaction per row) against workouts.add_workouts_bulk
+# Runs against a throwaway database so fitness.db is never touched
+# Usage: python bench_bulk_insert.py [rows for the bulk path] [rows for the per-row path]
+
+bulk_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+single_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+db.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+with db.transaction() as conn:
+    conn.executemany("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", [(1000 + s, f"student{s}", "password") for s in range(500)])
+
+random.seed(0)
+def make_rows(n):
+    return [(random.randint(1000, 1499), random.choice(workouts.valid_exercises), random.randint(1, 60), float(random.choice([0, 10, 20, 40])), random.randint(0, 1)) for _ in range(n)]
+
+rows = make_rows(single_rows)
+start = time.perf_counter()
+for row in rows:
+    workouts.add_workout(*row)
+single_time = time.perf_counter() - start
+
+rows = make_rows(bulk_rows)
+start = time.perf_counter()
+inserted, rejected = workouts.add_workouts_bulk(rows)
+bulk_time = time.perf_counter() - start
+
+print(f"per-row add_workout : {single_rows:>8} rows in {single_time:7.3f}s  {single_rows / single_time:>12,.0f} rows/sec")
+print(f"add_workouts_bulk   : {inserted:>8} rows in {bulk_time:7.3f}s  {inserted / bulk_time:>12,.0f} rows/sec")
+print(f"speed up            : {(inserted / bulk_time) / (single_rows / single_time):.1f}x")
+db.close_all()
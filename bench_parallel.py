@@ -0,0 +1,40 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import db
+import workouts
+from parallel_forecast import run_forecasts, all_units
+
+# Scaling benchmark for parallel_forecast.run_forecasts at 1, 2, 4 and 8 workers
+# Seeds a throwaway database with a cohort so fitness.db is never touched
+# Usage: python bench_parallel.py [students] [workouts per series] [--render]
+
+students = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 300
+per_series = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 200
+render = "--render" in sys.argv
+
+db.configure(os.path.join(tempfile.mkdtemp(), "bench.db"))
+random.seed(0)
+with db.transaction() as conn:
+    conn.executemany("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", [(1000 + s, f"student{s}", "password") for s in range(students)])
+rows = []
+for s in range(students):
+    for exercise in random.sample(workouts.valid_exercises, 4):
+        for i in range(per_series):
+            rows.append((1000 + s, exercise, random.randint(5, 120), float(random.choice([0, 10, 20, 40, 60])), 0, f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:00:00"))
+workouts.add_workouts_bulk(rows)
+units = all_units()
+if render:
+    os.chdir(tempfile.mkdtemp()) # the PNGs go to a scratch folder
+
+print(f"{len(units)} series, {per_series} workouts each, {os.cpu_count()} CPUs")
+baseline = None
+for workers in (1, 2, 4, 8):
+    start = time.perf_counter()
+    results = run_forecasts(units, workers=workers, render=render)
+    elapsed = time.perf_counter() - start
+    baseline = baseline or elapsed
+    print(f"{workers} workers: {elapsed:7.2f}s  {len(results) / elapsed:8.1f} series/sec  {baseline / elapsed:4.1f}x")
+db.close_all()
@@ -0,0 +1,62 @@
+import sys
+import time
+import numpy as np
+from predictor import fit_polynomials
+
+# Benchmark: the old pure Python polynomial_regression/gaussian_elimination against fit_polynomials
+# Both fit reps and weights (the old code needs two separate fits) for histories of 10 to 100k workouts
+# Usage: python bench_regression.py [largest history size]
+
+largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+
+# The previous implementation, kept here only to compare against
+def old_polynomial_regression(x_values, y_values, degree=2):
+    X = [[x**i for i in range(degree+1)]for x in x_values]
+    XT = list(map(list, zip(*X)))
+    XT_X = [[sum(a*b for a, b in zip(row, col))for col in zip(*X)] for row in XT]
+    XT_y = [sum(a*b for a, b in zip(row, y_values)) for row in XT]
+    return old_gaussian_elimination(XT_X, XT_y)
+
+def old_gaussian_elimination(A, b):
+    n = len(A)
+    for i in range(n):
+        pivot = A[i][i]
+        for J in range(i, n):
+            A[i][J] /= pivot
+        b[i] /=pivot
+        for k in range (i+1, n):
+            factor = A[k][i]
+            for J in range(i, n):
+                A[k][J] -= factor * A[i][J]
+            b[k] -= factor * b[i]
+    x = [0]*n
+    for i in range(n-1, -1, -1):
+        x[i] = b[i] - sum(A[i][J] * x[J] for J in range (i+1, n))
+    return x
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+rng = np.random.default_rng(0)
+print(f"{'workouts':>10} {'old (ms)':>12} {'numpy (ms)':>12} {'speed up':>10} {'max coeff diff':>16}")
+n = 10
+while n <= largest:
+    days = np.sort(rng.integers(0, max(n // 2, 5), n))
+    reps = (20 + 0.05 * days + rng.normal(0, 3, n)).tolist()
+    weights = (10 + 0.02 * days + rng.normal(0, 1, n)).tolist()
+    day_list = days.tolist()
+    repeat = 5 if n <= 10000 else 1
+
+    old_time, old = best_of(repeat, lambda: (old_polynomial_regression(day_list, reps), old_polynomial_regression(day_list, weights)))
+    new_time, new = best_of(repeat, lambda: fit_polynomials(days, np.column_stack([reps, weights])))
+    diff = np.max(np.abs(np.array(old).T - new) / np.maximum(np.abs(new), 1e-9))
+    print(f"{n:>10} {old_time * 1000:>12.3f} {new_time * 1000:>12.3f} {old_time / new_time:>9.1f}x {diff:>16.2e}")
+    n *= 10
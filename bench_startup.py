@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+# Startup benchmark and regression check for gui.py
+# Runs python -X importtime on "import gui" in a fresh interpreter and prints the slowest imports, then times
+# how long it takes from the start of the import until the login window is drawn
+# Exits with status 1 if a module that should be lazy (numpy, matplotlib, ...) is imported before the login
+# window, or if the login window takes longer than BUDGET seconds (skipped when there is no display)
+# Usage: python bench_startup.py [number of imports to list] [budget in seconds]
+
+top = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+BUDGET = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+LAZY = ["numpy", "matplotlib", "pytz", "schedule", "predictor", "prediction_cache", "chart_cache", "charts", "concurrent.futures"]
+
+here = os.path.dirname(os.path.abspath(__file__))
+# the login window never touches the database, but a throwaway one is used in case that changes
+env = {**os.environ, "FITNESS_DB": os.path.join(tempfile.mkdtemp(), "startup.db")}
+
+
+def run(code, *options):
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=here, env=env, capture_output=True, text=True)
+
+
+# import times: "import time: self [us] | cumulative | imported package" on stderr
+result = run("import gui", "-X", "importtime")
+if result.returncode != 0:
+    sys.exit(result.stderr)
+imports = []
+for line in result.stderr.splitlines():
+    if line.startswith("import time:") and "self [us]" not in line:
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+total = next(cumulative for cumulative, _, name in imports if name.strip() == "gui")
+print(f"import gui: {total / 1000:.1f} ms")
+print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+for cumulative, self_us, name in sorted(imports, reverse=True)[:top]:
+    print(f"{cumulative / 1000:14.1f} {self_us / 1000:8.1f}  {name}")
+
+failed = False
+loaded = {name.strip() for _, _, name in imports}
+eager = [name for name in LAZY if name in loaded]
+if eager:
+    print("FAIL imported at startup:", ", ".join(eager))
+    failed = True
+
+# time from the first import until the login window is on screen
+window = run("""
+import time
+start = time.perf_counter()
+import gui
+window = gui.build_login_window()
+window.update()
+print(time.perf_counter() - start)
+window.destroy()
+""")
+if window.returncode != 0:
+    print("login window: skipped (no display)" if "display" in window.stderr.lower() else window.stderr)
+else:
+    seconds = float(window.stdout.split()[-1])
+    print(f"login window ready: {seconds * 1000:.1f} ms (budget {BUDGET * 1000:.0f} ms)")
+    if seconds > BUDGET:
+        print("FAIL login window is over budget")
+        failed = True
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import time
+import db
+from workouts import add_workout
+from workout_writer import WorkoutWriter
+
+# Benchmark: logging workouts one commit at a time (workouts.add_workout) against the write-behind queue
+# (workout_writer.WorkoutWriter), with synchronous=FULL so every commit really waits for an fsync
+# Runs against a throwaway database so fitness.db is never touched
+# Usage: python bench_write_behind.py [workouts] [flush ms]
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+flush_ms = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+db.configure(os.path.join(tempfile.mkdtemp(), "bench.db"), synchronous="FULL")
+with db.transaction() as conn:
+    conn.executemany("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", [(1000 + s, f"student{s}", "password") for s in range(30)])
+rows = [(1000 + i % 30, "pushups", 10 + i % 20, 0.0, True) for i in range(count)]
+
+start = time.perf_counter()
+for row in rows:
+    add_workout(*row)
+per_row = time.perf_counter() - start
+print(f"one commit per workout: {count / per_row:10,.0f} workouts/s ({per_row * 1000 / count:.2f} ms each, {count} commits)")
+
+writer = WorkoutWriter(flush_ms=flush_ms)
+start = time.perf_counter()
+futures = [writer.log(*row, "2025-01-01 08:00:00") for row in rows]
+queued = time.perf_counter() - start
+for future in futures:
+    future.result()
+done = time.perf_counter() - start
+writer.close()
+print(f"write-behind:           {count / done:10,.0f} workouts/s ({queued * 1e6 / count:.1f} us to queue each, {writer.batches} commits)")
+db.close_all()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import shutil
+import threading
+from importlib.metadata import version
+import numpy as np
+
+# On-disk cache of rendered chart PNGs so showing an unchanged chart again doesn't touch matplotlib
+# A chart is stored under the sha256 of its kind, the numbers it plots and everything else that changes
+# the picture (exercise, level, CHART_VERSION and the matplotlib version), the student id isn't part of it
+# because it doesn't appear on the chart, so identical charts are only stored once
+# The folder is kept under MAX_BYTES by deleting the least recently used files (last use = file mtime)
+# charts.py is only imported when a chart actually has to be drawn
+
+CACHE_DIR = "chart_cache"
+MAX_BYTES = 64 * 1024 * 1024
+CHART_VERSION = 1 # bump when the drawing code in charts.py changes so old pictures aren't served
+
+_lock = threading.Lock()
+_matplotlib_version = version("matplotlib")
+
+
+def prediction_filename(student_id, exercise, user_level):
+    return f"prediction_{student_id}_{exercise}_{user_level}.png"
+
+
+def progress_filename(student_id, exercise):
+    return f"progress_{student_id}_{exercise}.png"
+
+
+def chart_key(kind, arrays, params):
+    # arrays: the data series plotted, params: the other values that change how the chart looks
+    digest = hashlib.sha256(f"{kind}|{CHART_VERSION}|{_matplotlib_version}|{params!r}".encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(f"|{array.dtype.str}{array.shape}|".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def _evict(directory, max_bytes):
+    # Deletes the least recently used charts until the folder fits in max_bytes
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(".png"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass # another process got there first
+        total -= size
+
+
+def _from_cache(cache_file, path):
+    # Returns the PNG bytes (path=None) or copies the chart to path and returns path, None if it isn't cached
+    try:
+        os.utime(cache_file) # marks it as just used for the LRU
+        if path is None:
+            with open(cache_file, "rb") as f:
+                return f.read()
+        shutil.copyfile(cache_file, path)
+        return path
+    except FileNotFoundError:
+        return None # not cached (or evicted by another process in between)
+
+
+def _cached(key, render, path, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+    # Returns the PNG bytes (path=None) or copies the chart to path and returns path
+    # render() is called to draw the chart (as bytes) only when it isn't in the cache
+    cache_file = os.path.join(directory, key + ".png")
+    cached = _from_cache(cache_file, path)
+    if cached is not None:
+        return cached
+    png = render()
+    os.makedirs(directory, exist_ok=True)
+    temporary = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(png)
+    os.replace(temporary, cache_file) # readers only ever see a complete file
+    with _lock:
+        _evict(directory, max_bytes)
+    if path is None:
+        return png
+    with open(path, "wb") as f:
+        f.write(png)
+    return path
+
+
+def copy_chart(key, path, directory=CACHE_DIR):
+    # Copies a chart that was already drawn to path by its key, without the data behind it
+    # Returns path, or None if it has been evicted and has to be drawn again
+    return _from_cache(os.path.join(directory, key + ".png"), path)
+
+
+def prediction_key(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, user_level="intermediate"):
+    # The key a prediction chart is stored under (prediction_cache.py keeps it to serve the chart with copy_chart)
+    arrays = [np.asarray(a, dtype=float) for a in (days, reps, weights, future_days, future_reps, future_weights)]
+    return chart_key("prediction", arrays, (exercise, user_level, float(reps_ci), float(weights_ci)))
+
+
+def prediction_chart(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level="intermediate", path=None, key=None):
+    # Cached charts.render_prediction, key can be passed in when the caller already worked it out with prediction_key
+    def render():
+        from charts import render_prediction
+        return render_prediction(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level)
+    key = key or prediction_key(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, user_level)
+    return _cached(key, render, path)
+
+
+def progress_chart(dates, reps, weights, exercise, student_id, path=None):
+    # Cached charts.render_progress
+    def render():
+        from charts import render_progress
+        return render_progress(dates, reps, weights, exercise, student_id)
+    arrays = [np.asarray(dates, dtype="datetime64[s]").astype(np.int64), np.asarray(reps, dtype=float), np.asarray(weights, dtype=float)]
+    return _cached(chart_key("progress", arrays, (exercise,)), render, path)
+
+
+def clear(directory=CACHE_DIR):
+    shutil.rmtree(directory, ignore_errors=True)
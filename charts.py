@@ -0,0 +1,136 @@
+import io
+import os
+import sys
+import threading
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import AutoDateLocator, DateFormatter, date2num
+from chart_cache import prediction_filename, progress_filename
+
+# Off-screen chart rendering for the prediction_* and progress_* charts
+# Uses the Agg canvas directly (no pyplot, so no global figure list and nothing ever opens a window)
+# Each thread builds one figure per chart type and reuses it for every render, only the line data,
+# the shaded confidence bands and the titles change, so rendering thousands of charts uses the same memory as one
+# Every render function returns the PNG bytes, or writes them to path and returns the path
+# (the app goes through chart_cache.py, which only calls these when the chart isn't cached already)
+# Usage: python charts.py [directory] [--progress]   (renders the charts for every student and exercise)
+
+_local = threading.local() # figures are not thread safe, every thread gets its own
+
+
+def _style(ax, xlabel, ylabel):
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.grid(True, linestyle="--", alpha=0.6)
+
+
+def _prediction_figure():
+    # Two side by side plots (reps and weight), each with the actual values, the prediction and a shaded 95% CI
+    if not hasattr(_local, "prediction"):
+        fig = Figure(figsize=(12, 5))
+        FigureCanvasAgg(fig)
+        chart = {"fig": fig}
+        for key, ylabel, colour in (("reps", "Reps", "gray"), ("weights", "Weight (Kg)", "red")):
+            ax = fig.add_subplot(1, 2, 1 if key == "reps" else 2)
+            actual, = ax.plot([], [], label="Actual Reps" if key == "reps" else "Actual Weight", marker="o")
+            predicted, = ax.plot([], [], label="predicted Reps" if key == "reps" else "predicted weight", linestyle="--", marker="x")
+            band = ax.fill_between([], [], [], color=colour, alpha=0.2, label="95% CI")
+            _style(ax, "Days since first workout", ylabel)
+            ax.set_title("Prediction") # placeholder so tight_layout leaves room for the title
+            ax.legend()
+            chart[key] = {"ax": ax, "actual": actual, "predicted": predicted, "band": band, "colour": colour}
+        fig.tight_layout()
+        _local.prediction = chart
+    return _local.prediction
+
+
+def _progress_figure():
+    # Reps above weight with a shared date axis
+    if not hasattr(_local, "progress"):
+        fig = Figure(figsize=(10, 8))
+        FigureCanvasAgg(fig)
+        ax1, ax2 = fig.subplots(2, 1, sharex=True)
+        reps, = ax1.plot([], [], marker="o", color="blue")
+        weights, = ax2.plot([], [], marker="o", color="red")
+        _style(ax1, "", "Reps")
+        _style(ax2, "Date", "Weight (Kg)")
+        ax2.xaxis.set_major_locator(AutoDateLocator())
+        ax2.xaxis.set_major_formatter(DateFormatter("%Y-%m-%d"))
+        ax2.tick_params(axis="x", labelrotation=45)
+        fig.subplots_adjust(left=0.08, right=0.97, top=0.95, bottom=0.15, hspace=0.2)
+        _local.progress = {"fig": fig, "reps": (ax1, reps), "weights": (ax2, weights)}
+    return _local.progress
+
+
+def _rescale(ax):
+    ax.relim()
+    ax.autoscale_view()
+
+
+def _output(fig, path):
+    if path is None:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    fig.savefig(path, format="png")
+    return path
+
+
+def render_prediction(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level="intermediate", path=None):
+    # Same chart as the old predictor.plot_predictions
+    chart = _prediction_figure()
+    future_days = np.asarray(future_days, dtype=float).ravel()
+    future_reps = np.asarray(future_reps, dtype=float)
+    future_weights = np.asarray(future_weights, dtype=float)
+    bands = {
+        "reps": (future_reps - reps_ci, future_reps + reps_ci),
+        "weights": (np.maximum.accumulate(future_weights - weights_ci), future_weights + weights_ci),
+    }
+    titles = {"reps": "Reps Prediction", "weights": "Weight Prediction"}
+    for key, actual, future in (("reps", reps, future_reps), ("weights", weights, future_weights)):
+        plot = chart[key]
+        plot["actual"].set_data(days, actual)
+        plot["predicted"].set_data(future_days, future)
+        plot["band"].remove() # fill_between makes a new polygon, the old one is taken off the axes
+        plot["band"] = plot["ax"].fill_between(future_days, *bands[key], color=plot["colour"], alpha=0.2, label="95% CI")
+        plot["ax"].set_title(f"{titles[key]} for {exercise.capitalize()} ({user_level.capitalize()} Level)")
+        _rescale(plot["ax"])
+    return _output(chart["fig"], path)
+
+
+def render_progress(dates, reps, weights, exercise, student_id, path=None):
+    # Same chart as the old gui.show_progress_chart, dates can be datetime64 values or datetime objects
+    chart = _progress_figure()
+    x = date2num(np.asarray(dates, dtype="datetime64[s]"))
+    for key, values, title in (("reps", reps, "Reps Progress"), ("weights", weights, "Weights Progress")):
+        ax, line = chart[key]
+        line.set_data(x, values)
+        ax.set_title(f"{title} for {exercise.capitalize()}")
+        _rescale(ax)
+    return _output(chart["fig"], path)
+
+
+def render_all(units, directory=".", progress=False, user_level="intermediate", degree=2, snapshot=None):
+    # Writes the prediction chart (and with progress=True the progress chart) for every (student_id, exercise)
+    # Returns the paths written, series without enough data for a prediction are skipped
+    from predictor import get_workout_data, predict_targets
+    paths = []
+    for student_id, exercise in units:
+        dates, reps, weights = get_workout_data(student_id, exercise, snapshot)
+        result = predict_targets(dates, reps, weights, user_level, degree)
+        if result:
+            days, future_days, future_reps, future_weights, reps_ci, weights_ci, level = result
+            path = os.path.join(directory, prediction_filename(student_id, exercise, level))
+            paths.append(render_prediction(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, level, path))
+        if progress and len(dates):
+            paths.append(render_progress(dates, reps, weights, exercise, student_id, os.path.join(directory, progress_filename(student_id, exercise))))
+    return paths
+
+
+if __name__ == "__main__":
+    from parallel_forecast import all_units
+    args = [arg for arg in sys.argv[1:] if arg != "--progress"]
+    directory = args[0] if args else "."
+    os.makedirs(directory, exist_ok=True)
+    print(f"{len(render_all(all_units(), directory, progress='--progress' in sys.argv))} charts written to {directory}")
@@ -0,0 +1,39 @@
+import os
+import random
+import sys
+import tempfile
+import db
+import database
+
+# Query plan regression check for the hot user_workouts queries
+# Seeds a throwaway database, then runs EXPLAIN QUERY PLAN on every query in database.hot_queries()
+# Exits with status 1 if any of them falls back to a full table scan or a temp b-tree sort
+# Usage: python check_query_plans.py [number of students]
+
+students = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+exercises = ["situps", "pushups", "squat", "deadlift", "bench press", "leg press", "pullups", "row"]
+
+tmp_dir = tempfile.mkdtemp()
+db.configure(os.path.join(tmp_dir, "plans.db")) # the schema and indexes are created on first connection
+
+random.seed(0)
+with db.transaction() as conn:
+    conn.executemany("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", [(1000 + s, f"student{s}", "password") for s in range(students)])
+    rows = []
+    for s in range(students):
+        for exercise in random.sample(exercises, 4):
+            for day in range(20):
+                rows.append((1000 + s, exercise, random.randint(5, 50), random.choice([0.0, 10.0, 20.0]), 0, f"2025-01-{day % 28 + 1:02d} 08:00:00"))
+    conn.executemany("INSERT INTO user_workouts (student_id, exercise, reps, weight, is_bodyweight, datetime) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.execute("ANALYZE") # gives the planner real statistics like a long-running database would have
+
+queries = database.hot_queries()
+problems = database.find_full_scans(db.get_connection(), queries)
+for name in queries:
+    print("FAIL" if name in problems else "ok  ", name)
+    if name in problems:
+        for line in problems[name]:
+            print("       ", line)
+db.close_all()
+
+sys.exit(1 if problems else 0)
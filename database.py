@@ -1,105 +1,94 @@
-import sqlite3
+from db import get_connection, transaction, workouts_changed
+from migrations import migrate
+from timestamps import now_text, to_datetime64
+from workout_series import fetch_series
 
 def init_db():
-    conn = sqlite3.connect("fitness.db") 
-    # Connects to the database file (Creates if it doesn't exists)
-    cursor = conn.cursor()
-    # Creates users table to store all users informaation with name and password, student_id is the unique identifier
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users( 
-        student_id INTEGER PRIMARY KEY AUTOINCREMENT, 
-        name TEXT NOT NULL,
-        password TEXT NOT NULL 
-     )
-    """)
-# Creates the user workouts table to store all workout entries for each user
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_workouts (
-           id INTEGER PRIMARY KEY AUTOINCREMENT,
-           student_id INTEGER NOT NULL,                          
-           exercise TEXT NOT NULL,
-           reps INTEGER NOT NULL,
-           weight REAL NOT NULL,
-           is_bodyweight INTEGER NOT NULL,
-           datetime TEXT DEFAULT CURRENT_TIMESTAMP,
-           FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
-        )                                                    
-    """)
-    # Creates a join to users table on  the foreign key of student_id
-
-    conn.commit() # commits the changes to the database
-    conn.close() # closes the connection to the database
+    # Creates or upgrades the schema, the tables and indexes are defined as versioned migrations in migrations.py
+    # This also runs automatically the first time the app connects to the database, so importing this file is free
+    return migrate()
+
+# SQL run by get_workout_history and get_exercise_list below
+HISTORY_QUERY = "SELECT id, datetime, exercise, reps, weight, is_bodyweight FROM user_workouts WHERE student_id = ? ORDER BY datetime DESC"
+EXERCISE_LIST_QUERY = "SELECT DISTINCT exercise FROM user_workouts WHERE student_id = ?"
+
+def hot_queries():
+    # The queries that run on every prediction, chart, history refresh and leaderboard view, taken from the
+    # constants the modules execute so the check can't drift from the code
+    # name -> (sql, sample parameters, allow_scan), allow_scan is only set for the few that read every row by design
+    # check_query_plans.py runs EXPLAIN QUERY PLAN on each of these to make sure none of them scans the whole table
+    import batch_predictor, leaderboard, workout_series, workout_stats, workouts # imported here, batch_predictor pulls in predictor
+    page, _ = leaderboard.page_query()
+    exercise_page, exercise_params = leaderboard.page_query(exercise="pushups")
+    student_page, student_params = leaderboard.page_query(student_id=1234)
+    rank_count, rank_params = leaderboard.count_query(exercise="pushups", above=1.0)
+    return {
+        "fetch_series_count": (workout_series.COUNT_QUERY, (1234, "pushups"), False),
+        "fetch_series": (workout_series.SERIES_QUERY, (1234, "pushups"), False),
+        "get_workout_history": (HISTORY_QUERY, (1234,), False),
+        "get_workout_first_page": (workouts.FIRST_PAGE_QUERY, (1234, 200), False),
+        "get_workout_page": (workouts.NEXT_PAGE_QUERY, (1234, "2025-01-01 00:00:00", 0, 200), False),
+        "get_exercise_list": (EXERCISE_LIST_QUERY, (1234,), False),
+        "get_exercises": (workout_stats.EXERCISES_QUERY, (1234,), False),
+        "batch_series": (batch_predictor.SERIES_QUERY, (), True),
+        "leaderboard_page": (page, (10, 20), True),
+        "leaderboard_page_exercise": (exercise_page, exercise_params + [10, 0], False),
+        "leaderboard_page_student": (student_page, student_params + [10, 0], False),
+        "leaderboard_rank": (rank_count, rank_params, False),
+        "rank_of": (leaderboard.RANK_QUERY, (1234, "pushups"), False),
+        "top_per_exercise": (leaderboard.TOP_QUERY, (), True),
+    }
+
+def find_full_scans(conn, queries=None):
+    # Returns {query name: plan lines} for every hot query that reads the whole table or sorts in a temp b-tree
+    # Only the queries marked allow_scan read everything on purpose (the batch forecast and the full leaderboard
+    # listings), and even they must scan a covering index; any other SCAN is a missing index
+    problems = {}
+    for name, (query, params, allow_scan) in (queries or hot_queries()).items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        bad = [line for line in plan if (line.startswith("SCAN") and not (allow_scan and "COVERING INDEX" in line)) or "TEMP B-TREE" in line]
+        if bad:
+            problems[name] = plan
+    return problems
 
     # USER functions
 def is_student_id_taken(student_id: int) -> bool:
-        conn = sqlite3.connect("fitness.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM users WHERE student_id = ?", (student_id,))
+        conn = get_connection()
+        cursor = conn.execute("SELECT 1 FROM users WHERE student_id = ?", (student_id,))
         exists = cursor.fetchone() is not None
-        conn.close()
         return exists
 
 def register_user(student_id: int, name: str, password: str):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (student_id, name, password,))
-      conn.commit()
-      conn.close()
+      with transaction() as conn:
+          conn.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (student_id, name, password,))
 
 # WORKOUT functions
 def add_workout(student_id: int, exercise: str, reps: int, weight: float, is_bodyweight: int):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("INSERT INTO user_workouts (student_id, exercise, reps, weight, is_bodyweight) VALUES (?, ?, ?, ?, ?)", (student_id, exercise, reps, weight, is_bodyweight,))
-      conn.commit()
-      conn.close()
+      with transaction() as conn:
+          # the time is set here (Hong Kong time like every other writer) instead of the column's UTC default
+          conn.execute("INSERT INTO user_workouts (student_id, exercise, reps, weight, is_bodyweight, datetime) VALUES (?, ?, ?, ?, ?, ?)", (student_id, exercise, reps, weight, is_bodyweight, now_text()))
+      workouts_changed(student_id, exercise)
 
 def get_exercise_list(student_id: int):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("SELECT DISTINCT exercise FROM user_workouts WHERE student_id = ?", (student_id,))
+      conn = get_connection()
+      cursor = conn.execute(EXERCISE_LIST_QUERY, (student_id,))
       exercises = [row[0] for row in cursor.fetchall()]
-      conn.close()
       return exercises
 
 def get_workout_data(student_id: int, exercise: str):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("SELECT datetime, reps, weight FROM user_workouts WHERE student_id = ? AND exercise = ? ORDER BY datetime ASC", (student_id, exercise,))
-      rows = cursor.fetchall()
-      conn.close()
-
-      dates = [row[0] for row in rows]
-      reps = [row[1] for row in rows]
-      weights = [row[2] for row in rows]
-      return dates, reps, weights
+      # Same as predictor.get_workout_data: datetime64 dates, reps and weights as numpy arrays
+      # (workout_series.fetch_series has the day numbers and is_bodyweight as well)
+      series = fetch_series(student_id, exercise)
+      return to_datetime64(series.ts), series.reps, series.weight
 
 def get_workout_history(student_id: int):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("SELECT id, datetime, exercise, reps, weight, is_bodyweight FROM user_workouts WHERE student_id = ? ORDER BY datetime DESC", (student_id,))
+      conn = get_connection()
+      cursor = conn.execute(HISTORY_QUERY, (student_id,))
       rows = cursor.fetchall()
-      conn.close()
       return rows
 
 def delete_workout(workout_id: int):
-      conn = sqlite3.connect("fitness.db")
-      cursor = conn.cursor()
-      cursor.execute("DELETE FROM user_workouts WHERE id = ?", (workout_id,))
-      conn.commit()
-      conn.close()
-
-init_db()
-
-
-import sqlite3
-
-conn = sqlite3.connect("fitness.db")
-cursor = conn.cursor()
-
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-tables = cursor.fetchall()
-print(tables)
-
-
-
+      with transaction() as conn:
+          deleted = conn.execute("DELETE FROM user_workouts WHERE id = ? RETURNING student_id, exercise", (workout_id,)).fetchall()
+      for student_id, exercise in deleted:
+          workouts_changed(student_id, exercise)
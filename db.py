@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Shared connection layer for the whole app
+# Every module asks this file for a connection instead of calling sqlite3.connect("fitness.db") itself
+# Each thread gets its own connection which is opened once and then reused
+
+# Path to the database file, can be overridden with the FITNESS_DB environment variable
+DB_PATH = os.environ.get("FITNESS_DB", "fitness.db")
+
+# PRAGMAs that are set once when a connection is opened
+PRAGMAS = {
+    "journal_mode": "WAL", # readers don't block the writer and the writer doesn't block readers
+    "synchronous": "NORMAL", # safe with WAL and avoids an fsync on every commit
+    "cache_size": -16000, # negative value is in KiB so this is about 16MB of page cache
+    "mmap_size": 268435456, # lets sqlite read the file through a 256MB memory map
+    "foreign_keys": "ON", # makes ON DELETE CASCADE work on every connection
+    "busy_timeout": 5000, # waits up to 5 seconds for a lock instead of failing straight away
+}
+
+# Read-only connections (used by worker processes) open the file with mode=ro so they can never write to it
+READ_ONLY = False
+
+# Number of prepared statements each connection keeps cached
+# sqlite3 reuses the compiled statement whenever the same SQL string is executed again
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_lock = threading.Lock()
+_connections = [] # every open connection so close_all() can close them
+_generation = 0 # bumped by close_all() so threads know their cached connection was closed
+_migrated = set() # database paths this process has already brought up to the latest schema
+_migrate_lock = threading.Lock()
+
+
+def configure(path=None, read_only=None, **pragmas):
+    # Changes the database path, read-only mode and/or PRAGMAs, existing connections are closed
+    # so the next get_connection() call opens a connection with the new settings
+    global DB_PATH, READ_ONLY
+    close_all()
+    if path is not None:
+        DB_PATH = path
+    if read_only is not None:
+        READ_ONLY = read_only
+    PRAGMAS.update(pragmas)
+
+
+def _connect(path):
+    # isolation_level=None means sqlite3 won't open transactions behind our back,
+    # transaction() below is the only place that starts and ends them
+    if READ_ONLY:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in PRAGMAS.items():
+        if READ_ONLY and name == "journal_mode":
+            continue # changing the journal mode is a write, the writer connections already set it
+        conn.execute(f"PRAGMA {name} = {value}")
+    with _lock:
+        _connections.append((os.getpid(), conn))
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    # Returns the connection for the current thread, opening it on first use
+    # A new connection is also opened after a fork or after close_all()/configure()
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid() and _local.generation == _generation:
+        return conn
+    conn = _connect(DB_PATH)
+    _local.conn = conn
+    _local.pid = os.getpid()
+    _local.generation = _generation
+    _ensure_schema()
+    return conn
+
+
+def _ensure_schema():
+    # Runs the pending migrations once per database per process, the first time it is connected to
+    # This replaces the old init_db() call that ran every time database.py was imported
+    if READ_ONLY or DB_PATH in _migrated or getattr(_local, "migrating", False):
+        return
+    with _migrate_lock:
+        if DB_PATH in _migrated:
+            return
+        _local.migrating = True # migrate() calls get_connection() itself
+        try:
+            from migrations import migrate
+            migrate()
+            _migrated.add(DB_PATH)
+        finally:
+            _local.migrating = False
+
+
+@contextmanager
+def transaction():
+    # Runs the block in a single transaction, commits on success and rolls back on any error
+    # Nested calls use a savepoint so an inner failure only undoes the inner block
+    conn = get_connection()
+    if conn.in_transaction:
+        name = f"sp_{getattr(_local, 'depth', 0)}"
+        _local.depth = getattr(_local, "depth", 0) + 1
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+        finally:
+            _local.depth -= 1
+        return
+    # BEGIN IMMEDIATE takes the write lock up front so two writers can't deadlock halfway through
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+
+def close_connection():
+    # Closes the current thread's connection
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    if _local.pid != os.getpid():
+        return # belongs to the parent process, leave it alone
+    with _lock:
+        _connections[:] = [(pid, c) for pid, c in _connections if c is not conn]
+    conn.close()
+
+
+def close_all():
+    # Closes every connection opened by this process (used when settings change or on shutdown)
+    global _generation
+    with _lock:
+        conns = [c for pid, c in _connections if pid == os.getpid()]
+        _connections.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.conn = None
+
+
+# Functions to call after workouts are added, changed or deleted (e.g. to drop cached predictions)
+# Each one is called as callback(student_id, exercise), None means "all students" or "all exercises"
+_workout_listeners = []
+
+
+def on_workouts_changed(callback):
+    _workout_listeners.append(callback)
+    return callback
+
+
+def workouts_changed(student_id=None, exercise=None):
+    # Called by the write functions after their transaction has committed
+    for callback in list(_workout_listeners):
+        callback(student_id, exercise)
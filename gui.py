@@ -3,15 +3,22 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import sqlite3
-import matplotlib.pyplot as plt
-from datetime import datetime
-import pytz
-from workouts import add_workout, get_workouts
-from predictor import (get_workout_data, predict_targets, plot_predictions, show_leaderboard)
-
-conn = sqlite3.connect("fitness.db")
-conn.execute("PRAGMA foreign_keys = ON")
-cursor = conn.cursor()
+import threading
+from bisect import bisect_left
+from workouts import get_workout_page, HISTORY_PAGE_SIZE
+from db import get_connection, transaction, workouts_changed
+from timestamps import now_text
+from tk_tasks import TaskRunner
+from workout_stats import get_exercises, has_exercise
+from student_ids import load_taken_ids, is_taken, mark_taken, mark_free
+tasks = None # runs the slow work off the Tk thread, made by launch_dashboard (see tk_tasks.py)
+catalog = None # the logged in student's exercises for the dropdowns, made by launch_dashboard
+writer = None # background writer that commits logged workouts in batches (see workout_writer.py)
+status_label = None # message on the left of the dashboard's status bar
+# numpy, matplotlib and the modules using them (predictor, prediction_cache, chart_cache, charts) are imported
+# inside the functions that need them so the login window opens without waiting for them;
+# preload_modules() loads them in the background once the user has logged in
+# foreign_keys is switched on for every connection by db.py so deleting a user cascades to their workouts
 #Leaderboard window
 # sets up the leaderboard table based on whether global or personal mode is selected
 def update_leaderboard(table, data, mode="global"):
@@ -45,21 +52,23 @@ def update_leaderboard(table, data, mode="global"):
             # inserts data into the table
             table.insert("", "end", values=(rank, student_id, name, exercise, rate_fmt))
         # Shows the global leaderboard as a table
+# The query runs on a worker thread and the table is filled in when it's done
+# Both leaderboards share the "leaderboard" task so clicking one after the other only shows the last one
 def show_global_leaderboard(table):
-    try:
-        data = show_leaderboard()
-        update_leaderboard(table, data, mode="global")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+    def work():
+        from predictor import show_leaderboard # imported on the worker thread, it brings in numpy
+        return show_leaderboard()
+    tasks.submit("leaderboard", work, lambda data: update_leaderboard(table, data, mode="global"))
 # shows the personal leaderboard
 def show_personal_leaderboard(table, student_id):
-    try:
-        raw_data = show_leaderboard(student_id=student_id)
+    def done(raw_data):
         personal_data = [(exercise, rate) for _, _, exercise, rate in raw_data]
         # updates the leaderboard table
         update_leaderboard(table, personal_data, mode="personal")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+    def work():
+        from predictor import show_leaderboard
+        return show_leaderboard(student_id=student_id)
+    tasks.submit("leaderboard", work, done)
 # Predictions
 def show_predictions(student_id, exercise_entry, level_label, table_widget):
     # for the predictions tab shows predicted reps and weights for a specific exercise
@@ -67,17 +76,23 @@ def show_predictions(student_id, exercise_entry, level_label, table_widget):
     if not exercise: # ensures user enters an exercis
         messagebox.showerror("Input Error", "Please enter an exercise name.")
         return
+    def work(): # runs on a worker thread: the forecast and the chart
+        from prediction_cache import cached_prediction_chart
+        # the forecast comes from the running sums and the chart is drawn once, both are cached until a workout
+        # is logged, edited or deleted, so showing it again is a single index lookup plus a file copy
+        return cached_prediction_chart(student_id, exercise)
+    # a new request (e.g. for another exercise) replaces one that is still running
+    tasks.submit("predictions", work, lambda done: show_prediction_result(exercise, level_label, table_widget, *done))
+
+def show_prediction_result(exercise, level_label, table_widget, count, result, filename):
+    # back on the Tk thread: opens the chart and fills in the level and the predictions table
     try:
-        dates, reps, weights = get_workout_data(student_id, exercise)
-
-        if not dates:
+        if count == 0:
             messagebox.showerror("Data Error", f"No workout data found for exercise: {exercise}, inaccurate date.")
             return
-        result = predict_targets(dates, reps, weights)
         if result:
             days, future_days, future_reps, future_weights, reps_ci, weights_ci, user_level = result
-            # generates and displays the prediction plot
-            plot_predictions(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level)
+            open_file(filename) # opens the saved prediction plot
             # ensures that the user level is visible and the text is green unless user hits expert where it's gold 
             level_label.config(text=f"Current Level: {user_level.capitalize()}", fg="gold" if user_level == "expert" else "green")
             if user_level == "expert":
@@ -94,45 +109,107 @@ def show_predictions(student_id, exercise_entry, level_label, table_widget):
     except Exception as e:
         messagebox.showerror("Error", str(e))
 # Workouts
-def add_workout(student_id, exercise, reps, weight, is_bodyweight, timestamp):
-    try:
-        with sqlite3.connect("fitness.db") as conn: # Connects to the database
-          cursor = conn.cursor() # creates a cursor object to execute the SQl commands
-          cursor.execute("INSERT INTO user_workouts (student_id, datetime, exercise, reps, weight, is_bodyweight) VALUES (?, ?, ?, ?, ?, ?)", (student_id, timestamp, exercise, reps, weight, is_bodyweight,))
-          conn.commit() # commits the changes to the database
-          
-    except Exception as e:
-        messagebox.showerror("Database Error", str(e))
-
-def get_workouts(student_id):
-    try:
-        conn = sqlite3.connect("fitness.db")
-        cursor = conn.cursor()
-        # makes sure that the data is fetched in the chronological order of workout date
-        cursor.execute("SELECT id, datetime, exercise, reps, weight, is_bodyweight FROM user_workouts WHERE student_id=? ORDER BY datetime", (student_id,))
-        return cursor.fetchall()
-    except Exception as e: # catches any datase errors
-        messagebox.showerror("Database Error", str(e)) 
-        return []
-    
-
 def get_exercise_list(student_id):
     try:
-        # Fetches all unique exercises for the dropdown menu
-        workouts = get_workouts(student_id)
-        exercises = sorted(set([w[2] for w in workouts]))
-        return exercises
+        # Fetches all unique exercises for the dropdown menu (from workout_stats, not the whole history)
+        return get_exercises(student_id)
     except Exception as e:
         messagebox.showerror("Error", str(e))
         return []
+
+class ExerciseCatalog:
+    # The exercises a student has logged, read once when the dashboard opens and shared by every exercise
+    # dropdown (Workouts and Charts tabs); logging or deleting a workout updates the list and the dropdowns
+    # in place instead of reading it again
+    def __init__(self, student_id):
+        self.student_id = student_id
+        self.exercises = get_exercise_list(student_id) # alphabetical
+        self.dropdowns = []
+
+    def attach(self, dropdown):
+        self.dropdowns.append(dropdown)
+        dropdown['values'] = self.exercises
+
+    def _refresh(self):
+        for dropdown in self.dropdowns:
+            dropdown['values'] = self.exercises
+
+    def added(self, exercise):
+        # call after logging a workout
+        position = bisect_left(self.exercises, exercise)
+        if position == len(self.exercises) or self.exercises[position] != exercise:
+            self.exercises.insert(position, exercise)
+            self._refresh()
+
+    def removed(self, exercise):
+        # call after deleting a workout, the exercise goes once the student has no workouts of it left
+        if exercise in self.exercises and not has_exercise(self.student_id, exercise):
+            self.exercises.remove(exercise)
+            self._refresh()
+# The history table is filled a page at a time (HISTORY_PAGE_SIZE workouts, oldest first) as the user scrolls
+# down, so a student with a huge log doesn't wait for (or hold in the table) workouts they never look at
+# For every table this keeps the (datetime, id) of the rows loaded so far in order, the next page starts after
+# the last one, and logged or deleted workouts are put in or taken out of the table where they are
+history_pages = {} # table -> {"student_id", "keys": sorted (datetime, id) list, "rows": id -> key, "done", "loading"}
+
+def history_values(workout):
+    workout_id, date, exercise, reps, weight, is_bodyweight = workout
+    return (workout_id, date, exercise, reps, weight, "Yes" if  is_bodyweight else "No")
+
 # Displays user workout hsitory in the table
 def show_workout_history(student_id, table):
-    # Clears existing entries in the table
+    # Clears existing entries in the table and starts again from the first page
     table.delete(*table.get_children())
-    workouts = get_workouts(student_id)
-    # Inserts each workout into the table
-    for workout_id, date, exercise, reps, weight, is_bodyweight in workouts:
-        table.insert("", "end", values=(workout_id, date, exercise, reps, weight, "Yes" if  is_bodyweight else "No"))
+    history_pages[table] = {"student_id": student_id, "keys": [], "rows": {}, "done": False, "loading": False}
+    load_history_page(table)
+
+def load_history_page(table):
+    # Adds the next page of workouts to the bottom of the table (does nothing if one is on the way or all are shown)
+    state = history_pages.get(table)
+    if state is None or state["done"] or state["loading"]:
+        return
+    state["loading"] = True
+    after = state["keys"][-1] if state["keys"] else None
+    student_id = state["student_id"]
+    def done(workouts):
+        if history_pages.get(table) is not state:
+            return # the table was cleared since
+        state["loading"] = False
+        for workout in workouts:
+            key = (workout[1], workout[0])
+            state["keys"].append(key)
+            state["rows"][workout[0]] = key
+            table.insert("", "end", iid=workout[0], values=history_values(workout))
+        if len(workouts) < HISTORY_PAGE_SIZE:
+            state["done"] = True
+    def failed(e):
+        state["loading"] = False
+        messagebox.showerror("Database Error", str(e))
+    # the workouts are read on a worker thread, the table is filled in on the Tk thread
+    tasks.submit("history", lambda: get_workout_page(student_id, after), done, failed)
+
+def insert_history_row(table, workout):
+    # Puts a newly logged workout in its place in the table, if it comes after the loaded pages it is left for
+    # the page that will contain it
+    state = history_pages.get(table)
+    if state is None:
+        return
+    key = (workout[1], workout[0])
+    if not state["done"] and (not state["keys"] or key > state["keys"][-1]):
+        return
+    position = bisect_left(state["keys"], key)
+    state["keys"].insert(position, key)
+    state["rows"][workout[0]] = key
+    table.insert("", position, iid=workout[0], values=history_values(workout))
+    table.see(workout[0])
+
+def remove_history_row(table, workout_id):
+    state = history_pages.get(table)
+    key = state["rows"].pop(workout_id, None) if state else None
+    if key is None:
+        return
+    del state["keys"][bisect_left(state["keys"], key)]
+    table.delete(workout_id)
 
 # Deletes selected workout from the database
 def delete_workout(student_id, table):
@@ -143,20 +220,22 @@ def delete_workout(student_id, table):
             messagebox.showerror("Selection Error", "Please select a workout to delete.")
             return
         
-        workout_id = table.item(selected[0])["values"][0]
-
-        conn = sqlite3.connect("fitness.db")
-        cursor=conn.cursor()
-        cursor.execute("DELETE FROM user_workouts WHERE id=? AND student_id=?", (workout_id, student_id,))
-        conn.commit() # commits all changes to the database
-        conn.close() # closes the connection to the database
+        workout_id = int(selected[0]) # rows are stored under their workout id
+
+        with transaction() as conn: # commits all changes to the database when the block ends
+            deleted = conn.execute("DELETE FROM user_workouts WHERE id=? AND student_id=? RETURNING exercise", (workout_id, student_id,)).fetchall()
+        for (exercise,) in deleted:
+            workouts_changed(student_id, exercise)
+            if catalog is not None:
+                catalog.removed(exercise)
         # Notifies the user that the workout has been deleted successfully
         messagebox.showinfo("Deleted", f"workout {workout_id} removed successfully.")
-        show_workout_history(student_id, table)
+        if deleted:
+            remove_history_row(table, workout_id)
     except Exception as e:
         messagebox.showerror("Error", str(e))
 # user logs a workout to the database but there are many validation checks implemented to ensure that data is inputted in a valid form
-def log_workout(student_id, workout_entry, exercise_dropdown, exercise_var, workout_table):
+def log_workout(student_id, workout_entry, exercise_var, workout_table):
     workout = workout_entry.get().strip()
     # Makes sure workout field is not empty and tells the user to enter a workout
     if not workout:
@@ -189,50 +268,56 @@ def log_workout(student_id, workout_entry, exercise_dropdown, exercise_var, work
         if exercise not in valid_exercises: # if not in the list error will be raised
             messagebox.showerror("Input Error", f"{exercise} is not a valid exercise.")
             return
-        hong_kong = pytz.timezone("Asia/Hong_Kong") # makes sure that current time is set to Hong Kong timezone
-        timestamp = datetime.now(hong_kong).strftime("%Y-%m-%d %H:%M:%S") # date format
-        # If data is in the valid format the workout will be logged to the database in user_workouts
-        add_workout(student_id, exercise, reps, weight, is_bodyweight, timestamp)
-        messagebox.showinfo("Success", f"workout logged: {exercise}, ({reps} reps, {weight} kg, bodyweight={is_bodyweight})")
+        timestamp = now_text() # current Hong Kong time in the stored date format (see timestamps.py)
+        # If data is in the valid format the workout is queued for the background writer, which saves it to
+        # user_workouts together with anything else logged around the same time, so the window never waits
+        future = writer.log(student_id, exercise, reps, weight, is_bodyweight, timestamp)
         workout_entry.delete(0, tk.END)
-
-        exercises = get_exercise_list(student_id)
-        exercise_dropdown['values'] = exercises
         exercise_var.set(exercise)
-        # Refresh the workout history table to show the newly logged workout
-        show_workout_history(student_id, workout_table)
+        set_status(f"saving {exercise}...")
+
+        def saved(workout_id): # back on the Tk thread once the workout is committed
+            set_status(f"workout logged: {exercise}, ({reps} reps, {weight} kg, bodyweight={is_bodyweight})")
+            catalog.added(exercise) # the dropdowns get the exercise if it is new
+            # Adds the newly logged workout to the workout history table
+            insert_history_row(workout_table, (workout_id, timestamp, exercise, reps, weight, is_bodyweight))
+        def failed(e):
+            set_status(f"{exercise} was not saved")
+            messagebox.showerror("Database Error", str(e))
+        tasks.watch(("log", id(future)), future, saved, failed) # every logged workout has its own key
 
 
     except Exception as e:
         messagebox.showerror("Input Error", str(e))
 
+def set_status(text):
+    if status_label is not None:
+        status_label.config(text=text)
+
 # checks if use wants to delete their account and deletes all data associated with their account from the database
 def delete_account(student_id):
     if messagebox.askyesno("confirm Delete", f"are you sure you want to delete account {student_id}?"):
         try:
-            cursor.execute("DELETE FROM users WHERE student_id = ?", (student_id,))
-            conn.commit()
+            with transaction() as conn:
+                conn.execute("DELETE FROM users WHERE student_id = ?", (student_id,))
+            mark_free(student_id)
+            workouts_changed(student_id) # their workouts went with the account
             messagebox.showinfo("Account Deleted", f"Account {student_id} has been removed.")
         except Exception as e: # catches any errors
             messagebox.showerror("Error", str(e))    
 def add_users(student_id, name, password):
     try:
-        conn = sqlite3.connect("fitness.db") # connects to the database
-        cursor = conn.cursor()
-        # allows user to be added to the users table
-        cursor.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (student_id, name, password))
-        conn.commit()
+        with transaction() as conn: # uses the shared connection to the database
+            # allows user to be added to the users table
+            conn.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (student_id, name, password))
+        mark_taken(student_id)
         messagebox.showinfo("Success", f"User {name} added with student ID {student_id}.")
     except sqlite3.IntegrityError:
         # if student exists an error message will be shown
         messagebox.showerror("Error", f"student ID {student_id} already exists.")
-        conn.close()
     except Exception as e:
         messagebox.showerror("Error", str(e))
 
-    finally:
-        conn.close() # finally clsoses the connection to the database
-
 
 # Charts
 import os
@@ -257,51 +342,52 @@ def show_progress_chart(student_id, exercise):
     if not exercise: # makes sure user has selected an exercise
         messagebox.showerror("Input Error", "Please select an exercise.")
         return
-    try: # fetches workout data for the selected exercise
+    def work(): # runs on a worker thread, fetches workout data for the selected exercise
+        from predictor import get_workout_data
+        from chart_cache import progress_chart, progress_filename
         dates, reps, weights = get_workout_data(student_id, exercise)
-        if not dates: # if no data is found for the exercise an error will be raised
+        if len(dates) == 0:
+            return None
+        # reps (blue) and weights (red) over time, drawn off screen by charts.py and saved as a png
+        # (copied from chart_cache.py without drawing when this exact chart was made before)
+        return progress_chart(dates, reps, weights, exercise, student_id, path=progress_filename(student_id, exercise))
+
+    def done(filename): # back on the Tk thread
+        if filename is None: # if no data is found for the exercise an error will be raised
             messagebox.showerror("Data Error", f"No workout data found for {exercise}.")
             return
-        
-        fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
-        # makes sure that reps chart is shon in blue and plotted as dots
-        ax1.plot(dates, reps, marker='o', color='blue')
-        # Title is set as rpes for the exercise
-        ax1.set_title(f"Reps Progress for {exercise.capitalize()}")
-        # makes sure y axis is labelled as reps
-        ax1.set_ylabel("Reps")
-        ax1.grid(True)
-       # weights is shown in red and plotted as dots
-        ax2.plot(dates, weights, marker='o', color='red')
-        ax2.set_title(f"Weights Progress for {exercise.capitalize()}")
-        # x axis is set as date and y axis is set as weight in kg
-        ax2.set_xlabel("Date")
-        ax2.set_ylabel("Weight (Kg)")
-        ax2.grid(True)
-
-        plt.xticks(rotation=45)
-        plt.tight_layout() # makes sure layout is adjusted properly
-        filename = f"progress_{student_id}_{exercise}.png"
-        plt.savefig(filename)
-        plt.show()
         open_file(filename)
      # Notifies the user that the chart has been generated and saved
         messagebox.showinfo("Chart Generated", f"progress charts saved as {filename}.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+    tasks.submit("chart", work, done)
 # Dashboard window
 def launch_dashboard(student_id, name): # sets up the main dashboard in the app
     root = tk.Tk() # creates the main window using the Tkinter library
     root.title(f"Fitness Dashboard - {name}") # sets up the title of the window
     root.geometry("900x600") # sets up size of the window
 
+    # status bar with a progress bar that moves while work is running in the background
+    global tasks, catalog, writer, status_label
+    status_bar = ttk.Frame(root)
+    status_bar.pack(side="bottom", fill="x")
+    status_label = ttk.Label(status_bar, text="")
+    status_label.pack(side="left", padx=5)
+    progress = ttk.Progressbar(status_bar, mode="indeterminate", length=120)
+    progress.pack(side="right", padx=5, pady=2)
+    tasks = TaskRunner(root, progress)
+    from workout_writer import WorkoutWriter # not needed (and not imported) until the dashboard opens
+    writer = WorkoutWriter()
+    def close():
+        writer.close() # commits any workouts still queued (waits at most one batch)
+        tasks.shutdown() # drops work that hasn't started, so closing the window never waits
+        root.destroy()
+    root.protocol("WM_DELETE_WINDOW", close)
+    threading.Thread(target=preload_modules, daemon=True).start()
+
     tab_control = ttk.Notebook(root)
     tab_control.pack(expand=1, fill="both") # makes sure tabs expand to fill the window
 
-    exercises = get_exercise_list(student_id)
-    exercise_var = tk.StringVar() # variable to hold selected exercise
-    exercise_dropdown = ttk.Combobox(tab_control, textvariable=exercise_var, values=exercises, state="readonly")
-    
+    catalog = ExerciseCatalog(student_id) # read once, the Workouts and Charts dropdowns share it
 
     # Leaderboards Tab
     tab_leaderboard = ttk.Frame(tab_control) # leaderboard tab frame
@@ -346,22 +432,24 @@ def launch_dashboard(student_id, name): # sets up the main dashboard in the app
     workout_entry = tk.Entry(tab_workouts, width=50) # Entry field for logging workouts
     workout_entry.pack(pady=5)
 
-    exercises = get_exercise_list(student_id) # fetches exercise list for dropdown menu
     exercise_var = tk.StringVar() # variable holds slected exercise
     # dropdown menu for deleting account
-    exercise_dropdown = ttk.Combobox(tab_workouts, textvariable=exercise_var, values=exercises, state="readonly")
+    exercise_dropdown = ttk.Combobox(tab_workouts, textvariable=exercise_var, state="readonly")
+    catalog.attach(exercise_dropdown) # fills in the student's exercises
     exercise_dropdown.pack(pady=5)
    # the button that allows a user to delete their account from the database
     delete_button = tk.Button(tab_workouts, text="Delete Account", command=lambda: delete_account(student_id))
     delete_button.pack(pady=5)
 # Buttons that allow the user to ladd a workout entry to the database and delete a selected workout entry from the database
-    tk.Button(tab_workouts, text="Add Workout", command=lambda: log_workout(student_id, workout_entry, exercise_dropdown, exercise_var, workout_table)).pack(pady=5)
+    tk.Button(tab_workouts, text="Add Workout", command=lambda: log_workout(student_id, workout_entry, exercise_var, workout_table)).pack(pady=5)
     tk.Button(tab_workouts, text="Delete Selected Workout", command=lambda: delete_workout(student_id, workout_table)).pack(pady=5)
     tk.Label(tab_workouts, text="Workout History", font=("Helvetica", 12)).pack(pady=10) # Tex, size and font properties
 
     # This table shows the user's workout history directly on the workouts tab
 
-    workout_table = ttk.Treeview(tab_workouts, columns=("ID", "Datetime", "Exercise", "Reps", "Weight", "Bodyweight"), show="headings")
+    history_frame = tk.Frame(tab_workouts)
+    history_frame.pack(expand=True, fill="both", pady=10)
+    workout_table = ttk.Treeview(history_frame, columns=("ID", "Datetime", "Exercise", "Reps", "Weight", "Bodyweight"), show="headings")
     workout_table.heading("ID", text="ID") # ID column heading
     workout_table.heading("Datetime", text="Datetime") # Datetime column heading
     workout_table.heading("Exercise", text="Exercise") # exercise column heading
@@ -369,7 +457,14 @@ def launch_dashboard(student_id, name): # sets up the main dashboard in the app
     workout_table.heading("Weight", text="Weight (Kg)") # Weight column heading
     workout_table.heading("Bodyweight", text="Bodyweight (1=True, 0=False)") # Bodyweight column heading
    # Size properties for the workout history table
-    workout_table.pack(expand=True, fill="both", pady=10)
+    history_scrollbar = ttk.Scrollbar(history_frame, orient="vertical", command=workout_table.yview)
+    history_scrollbar.pack(side="right", fill="y")
+    workout_table.pack(side="left", expand=True, fill="both")
+    def history_scrolled(first, last):
+        history_scrollbar.set(first, last)
+        if float(last) > 0.95: # near the bottom (or everything loaded fits), fetch the next page
+            load_history_page(workout_table)
+    workout_table.configure(yscrollcommand=history_scrolled)
 
 
 
@@ -383,18 +478,14 @@ def launch_dashboard(student_id, name): # sets up the main dashboard in the app
     tk.Label(tab_charts, text="Visualize Progress", font=("Helvetica", 12)).pack(pady=10)
     # Dropdown menu to select exercise to generate a chart for
     exercise_dropdown = ttk.Combobox(tab_charts, state="readonly")
-    # fetches exercise list for the dropdown menu
-    exercises = get_exercise_list(student_id)
-    # checks if exercises is a string and converts it to a list if so
-    if isinstance(exercises, str):
-        # Ensures that exercises is a list even if a single exercise is returned as a string
-        exercises = [exercises]
-
-    exercise_dropdown['values'] = exercises
+    # the exercise list for the dropdown menu, kept up to date as workouts are logged and deleted
+    catalog.attach(exercise_dropdown)
     # binds the dropdown menu to the exercise variable
     exercise_dropdown.pack(pady=5)
+    # picking another exercise cancels a chart that is still being made for the old one
+    exercise_dropdown.bind("<<ComboboxSelected>>", lambda event: tasks.cancel("chart"))
     # sets the default selected exercise to the first in the list
-    if exercises:
+    if catalog.exercises:
        # makes sure that current selection is the first exercise in the list
        exercise_dropdown.current(0)
      # The button that when the user presse generates and shows the progress chart for the selected exercise
@@ -406,31 +497,25 @@ def launch_dashboard(student_id, name): # sets up the main dashboard in the app
 
 
 # ensures that student id is unique for registartion
+ID_CHECK_DELAY_MS = 300 # pause in typing before the registration window checks the student id
+
 def is_student_id_taken(student_id):
-     conn = sqlite3.connect("fitness.db") # connects to the database
-     cursor = conn.cursor()
+     cursor = get_connection().cursor() # shared connection to the database
      # Checks if student id is already in the users table
      cursor.execute("SELECT 1 FROM users WHERE student_id = ?", (student_id,))
      exists = cursor.fetchone() is not None
-     conn.close()
      return exists
 
 
-# Welcome and login page
-login_window = tk.Tk()
-login_window.title("Fitness Tracker Login")
-login_window.geometry("400x400")
-# welcomes user to the app
-tk.Label(login_window, text="Welcome to Fitness Planet!", font=("Helvetica", 16)).pack(pady=20)
-tk.Label(login_window, text="Student ID: ").pack(pady=5)
-entry_id = tk.Entry(login_window) # entry field for student id
-entry_id.pack(pady=5)
+def preload_modules():
+    # Imports the prediction and chart code (numpy, matplotlib and its Agg backend) so the first prediction
+    # or chart the user asks for doesn't wait for it, called on a background thread after login
+    import prediction_cache
+    import chart_cache
+    import charts
 
-tk.Label(login_window, text="Password:").pack(pady=5)
-entry_pw = tk.Entry(login_window, show="*")
-entry_pw.pack(pady=5)
 
-def login():
+def login(login_window, entry_id, entry_pw):
     student_id = entry_id.get()
     password = entry_pw.get()
 
@@ -438,11 +523,9 @@ def login():
         messagebox.showerror("Login Error", "Student ID must be between 4-6 digits.")
         return
     
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     cursor.execute("SELECT name, password FROM users WHERE student_id = ? LIMIT 1 ", (int(student_id), ))
     result = cursor.fetchone()
-    conn.close()
     
 
     if result:
@@ -472,15 +555,35 @@ def open_registration():
     pw_entry = tk.Entry(reg_window, show="*")
     pw_entry.pack(pady=5)
     
-    def check_id_availability(event):
+    id_status = tk.Label(reg_window, text="") # says whether the typed student id is free
+    id_status.pack()
+    # the taken ids are read once on a background thread, after that every check is a set lookup
+    threading.Thread(target=load_taken_ids, daemon=True).start()
+    pending_check = [None] # the after() id of the check waiting for typing to stop
+
+    def check_id_availability():
+        pending_check[0] = None
+        if not id_status.winfo_exists():
+            return # the window was closed while waiting
         sid = id_entry.get()
-        if sid.isdigit() and is_student_id_taken(int(sid)): # checks if student id is available
-            messagebox.showwarning("ID Taken", "student Id is already taken.")
-            # If not available a warning message will be shown
+        if not sid.isdigit() or not (1000 <= int(sid) <= 999999):
+            id_status.config(text="Student ID must be between 4-6 digits.", fg="gray")
+            return
+        taken = is_taken(int(sid)) # checks if student id is available
+        if taken is None: # the ids are still loading, try again shortly
+            pending_check[0] = reg_window.after(ID_CHECK_DELAY_MS, check_id_availability)
+        elif taken:
+            id_status.config(text="Student ID is already taken.", fg="red")
         else:
-            messagebox.showinfo("ID Available", "STudent ID is available.")
+            id_status.config(text="Student ID is available.", fg="green")
 
-    id_entry.bind("<KeyRelease>", check_id_availability)
+    def id_typed(event):
+        # waits until the user stops typing for ID_CHECK_DELAY_MS before checking
+        if pending_check[0] is not None:
+            reg_window.after_cancel(pending_check[0])
+        pending_check[0] = reg_window.after(ID_CHECK_DELAY_MS, check_id_availability)
+
+    id_entry.bind("<KeyRelease>", id_typed)
 
     
 
@@ -500,30 +603,36 @@ def open_registration():
             return
 
         
-        conn = sqlite3.connect("fitness.db")
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (int(student_id), name, password))
-
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute("INSERT INTO users (student_id, name, password) VALUES (?, ?, ?)", (int(student_id), name, password))
+        mark_taken(int(student_id))
 
         messagebox.showinfo("Success", "Account created successfully!")
         reg_window.destroy() # destroys the registration window after successful registration
 
     tk.Button(reg_window, text="Create account", command=register).pack(pady=10)
 
-tk.Button(login_window, text="Login", command=login).pack(pady=10)
-tk.Button(login_window, text="register", command=open_registration).pack(pady=5)
-login_window.mainloop() # starts the loop where after user logs in the dashboard will open
-
-
-
-   
-  
-
-
-     
-
-    
-  
-
+def build_login_window():
+    # Welcome and login page
+    login_window = tk.Tk()
+    login_window.title("Fitness Tracker Login")
+    login_window.geometry("400x400")
+    # welcomes user to the app
+    tk.Label(login_window, text="Welcome to Fitness Planet!", font=("Helvetica", 16)).pack(pady=20)
+    tk.Label(login_window, text="Student ID: ").pack(pady=5)
+    entry_id = tk.Entry(login_window) # entry field for student id
+    entry_id.pack(pady=5)
+
+    tk.Label(login_window, text="Password:").pack(pady=5)
+    entry_pw = tk.Entry(login_window, show="*")
+    entry_pw.pack(pady=5)
+
+    tk.Button(login_window, text="Login", command=lambda: login(login_window, entry_id, entry_pw)).pack(pady=10)
+    tk.Button(login_window, text="register", command=open_registration).pack(pady=5)
+    return login_window
+
+def main():
+    build_login_window().mainloop() # starts the loop where after user logs in the dashboard will open
+
+if __name__ == "__main__":
+    main()
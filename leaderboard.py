@@ -0,0 +1,190 @@
+import sys
+from itertools import groupby, islice
+from db import get_connection, transaction
+
+# Leaderboard rollup: one row per (student_id, exercise) with the first and latest workout time, the lowest and
+# highest reps and the improvement rate (reps gained per day), so a leaderboard view is an indexed top-k query
+# instead of a GROUP BY over every workout
+# Triggers on user_workouts keep it current. Inserts are O(1); a delete or update only rereads the series
+# (through idx_workouts_series) when the removed workout was its first, latest, lowest or highest
+# Reading it: leaderboard_page() for top k / offset and limit pages, rank_of() for one student's rank in an exercise
+# and top_per_exercise() for the top k of every exercise in one pass. Ranks are like RANK(): equal rates share a rank
+# Usage: python leaderboard.py rebuild   (recomputes the whole table from user_workouts)
+#        python leaderboard.py top [k] [offset] [exercise]
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS leaderboard_stats (
+       student_id INTEGER NOT NULL,
+       exercise TEXT NOT NULL,
+       first_at TEXT NOT NULL,
+       last_at TEXT NOT NULL,
+       min_reps INTEGER NOT NULL,
+       max_reps INTEGER NOT NULL,
+       rate REAL NOT NULL,
+       PRIMARY KEY (student_id, exercise)
+    ) WITHOUT ROWID
+"""
+
+INDEXES = {
+    "idx_leaderboard_rate": "leaderboard_stats(rate DESC, student_id, exercise)",
+    "idx_leaderboard_exercise_rate": "leaderboard_stats(exercise, rate DESC, student_id)",
+    "idx_leaderboard_student_rate": "leaderboard_stats(student_id, rate DESC, exercise)",
+}
+
+# Improvement rate as in the old show_leaderboard: (max reps - min reps) / days between first and latest workout
+# (at least 1 day so there is no division by 0)
+RATE = "(max_reps - min_reps) * 1.0 / MAX((CAST(strftime('%s', last_at) AS INTEGER) - CAST(strftime('%s', first_at) AS INTEGER)) / 86400, 1)"
+
+
+def _series(row, column):
+    # subquery that rereads one value for the series through idx_workouts_series
+    return f"(SELECT {column} FROM user_workouts WHERE student_id = {row}.student_id AND exercise = {row}.exercise)"
+
+
+def _insert_sql(row):
+    where = f"student_id = {row}.student_id AND exercise = {row}.exercise"
+    return f"""
+        INSERT OR IGNORE INTO leaderboard_stats (student_id, exercise, first_at, last_at, min_reps, max_reps, rate)
+        VALUES ({row}.student_id, {row}.exercise, {row}.datetime, {row}.datetime, {row}.reps, {row}.reps, 0);
+        UPDATE leaderboard_stats SET
+            first_at = MIN(first_at, {row}.datetime), last_at = MAX(last_at, {row}.datetime),
+            min_reps = MIN(min_reps, {row}.reps), max_reps = MAX(max_reps, {row}.reps)
+        WHERE {where};
+        UPDATE leaderboard_stats SET rate = {RATE} WHERE {where};
+    """
+
+
+def _delete_sql(row):
+    where = f"student_id = {row}.student_id AND exercise = {row}.exercise"
+    return f"""
+        UPDATE leaderboard_stats SET
+            first_at = CASE WHEN {row}.datetime = first_at THEN {_series(row, 'MIN(datetime)')} ELSE first_at END,
+            last_at = CASE WHEN {row}.datetime = last_at THEN {_series(row, 'MAX(datetime)')} ELSE last_at END,
+            min_reps = CASE WHEN {row}.reps = min_reps THEN {_series(row, 'MIN(reps)')} ELSE min_reps END,
+            max_reps = CASE WHEN {row}.reps = max_reps THEN {_series(row, 'MAX(reps)')} ELSE max_reps END
+        WHERE {where} AND EXISTS {_series(row, '1')};
+        DELETE FROM leaderboard_stats WHERE {where} AND NOT EXISTS {_series(row, '1')};
+        UPDATE leaderboard_stats SET rate = {RATE} WHERE {where};
+    """
+
+
+TRIGGERS = {
+    "trg_leaderboard_insert": f"AFTER INSERT ON user_workouts BEGIN {_insert_sql('NEW')} END",
+    "trg_leaderboard_delete": f"AFTER DELETE ON user_workouts BEGIN {_delete_sql('OLD')} END",
+    "trg_leaderboard_update": f"AFTER UPDATE OF student_id, exercise, reps, datetime ON user_workouts BEGIN {_delete_sql('OLD')} {_insert_sql('NEW')} END",
+}
+
+
+def create_leaderboard_schema(conn):
+    conn.execute(CREATE_TABLE)
+    for name, definition in INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    for name, body in TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def rebuild_leaderboard():
+    # Full rebuild from user_workouts, one pass over idx_workouts_exercise
+    with transaction() as conn:
+        conn.execute("DELETE FROM leaderboard_stats")
+        conn.execute(f"""
+            INSERT INTO leaderboard_stats (student_id, exercise, first_at, last_at, min_reps, max_reps, rate)
+            SELECT student_id, exercise, MIN(datetime), MAX(datetime), MIN(reps), MAX(reps), 0
+            FROM user_workouts GROUP BY student_id, exercise
+        """)
+        conn.execute(f"UPDATE leaderboard_stats SET rate = {RATE}")
+        count = conn.execute("SELECT COUNT(*) FROM leaderboard_stats").fetchone()[0]
+    return count
+
+
+# Highest rate first, ties in a fixed order so pages never overlap; matches idx_leaderboard_rate so nothing is sorted
+ORDER = "l.rate DESC, l.student_id, l.exercise"
+SELECT = "SELECT l.student_id, u.name, l.exercise, l.rate FROM leaderboard_stats l JOIN users u on u.student_id = l.student_id"
+# idx_leaderboard_exercise_rate is already in this order
+TOP_QUERY = f"{SELECT} ORDER BY l.exercise, l.rate DESC, l.student_id"
+RANK_QUERY = """SELECT (SELECT COUNT(*) FROM leaderboard_stats o WHERE o.exercise = l.exercise AND o.rate > l.rate) + 1,
+                  (SELECT COUNT(*) FROM leaderboard_stats o WHERE o.exercise = l.exercise), l.rate
+           FROM leaderboard_stats l WHERE l.student_id = ? AND l.exercise = ?"""
+
+
+def _filters(student_id=None, exercise=None):
+    filters, params = [], []
+    if student_id is not None:
+        filters.append("l.student_id = ?")
+        params.append(student_id)
+    if exercise is not None:
+        filters.append("l.exercise = ?")
+        params.append(exercise.lower())
+    return (" WHERE " + " AND ".join(filters)) if filters else "", params
+
+
+def page_query(student_id=None, exercise=None):
+    # (sql, params) for a page of leaderboard_page, LIMIT and OFFSET are the last two parameters still to add
+    where, params = _filters(student_id, exercise)
+    return f"{SELECT}{where} ORDER BY {ORDER} LIMIT ? OFFSET ?", params
+
+
+def count_query(student_id=None, exercise=None, above=None):
+    # (sql, params) counting the rows matching the filters (with a rate above `above` if it is given) on the rate indexes
+    where, params = _filters(student_id, exercise)
+    if above is not None:
+        where += (" AND" if where else " WHERE") + " l.rate > ?"
+        params = params + [above]
+    return "SELECT COUNT(*) FROM leaderboard_stats l" + where, params
+
+
+def _count(student_id=None, exercise=None, above=None):
+    return get_connection().execute(*count_query(student_id, exercise, above)).fetchone()[0]
+
+
+def leaderboard_page(limit=10, offset=0, student_id=None, exercise=None):
+    # One page of the leaderboard as (rank, student_id, name, exercise, rate) tuples
+    # Reads offset + limit index entries at most, so memory only depends on the page size
+    query, params = page_query(student_id, exercise)
+    cursor = get_connection().execute(query, params + [limit, offset])
+    page = []
+    for position, (sid, name, ex, rate) in enumerate(cursor, start=offset):
+        if not page:
+            rank = _count(student_id, exercise, above=rate) + 1 # the page may start in the middle of a tie
+        elif rate != page[-1][4]:
+            rank = position + 1
+        page.append((rank, sid, name, ex, rate))
+    return page
+
+
+def leaderboard_size(student_id=None, exercise=None):
+    # Number of entries, for working out how many pages there are
+    return _count(student_id, exercise)
+
+
+def rank_of(student_id, exercise):
+    # Returns (rank, number of students, rate) for a student in one exercise or None if they have no workouts for it
+    row = get_connection().execute(RANK_QUERY, (student_id, exercise.lower())).fetchone()
+    return tuple(row) if row else None
+
+
+def top_per_exercise(k=3):
+    # {exercise: [(rank, student_id, name, exercise, rate), ...]} with the top k of every exercise
+    # One pass over idx_leaderboard_exercise_rate, which is already in (exercise, rate) order, so only k rows
+    # per exercise are kept instead of a sort over everything
+    cursor = get_connection().execute(TOP_QUERY)
+    top = {}
+    for exercise, rows in groupby(cursor, key=lambda row: row[2]):
+        ranked = []
+        for position, (sid, name, ex, rate) in enumerate(islice(rows, k)):
+            rank = ranked[-1][0] if ranked and rate == ranked[-1][4] else position + 1
+            ranked.append((rank, sid, name, ex, rate))
+        top[exercise] = ranked
+    return top
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild"]:
+        print(f"leaderboard rebuilt with {rebuild_leaderboard()} rows")
+    elif sys.argv[1:2] == ["top"]:
+        k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        offset = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        exercise = sys.argv[4] if len(sys.argv) > 4 else None
+        for rank, student_id, name, ex, rate in leaderboard_page(k, offset, exercise=exercise):
+            print(f"{rank:>4}  {student_id}  {name:<20} {ex:<15} {rate:.2f}")
+    else:
+        print("Usage: python leaderboard.py rebuild | top [k] [offset] [exercise]")
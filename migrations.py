@@ -0,0 +1,321 @@
+import sys
+from db import get_connection, transaction
+from timestamps import epoch_sql
+
+# Versioned schema migrations for fitness.db
+# The schema version is stored in PRAGMA user_version, each migration moves it up by one
+# migrate() is called automatically the first time a process connects to a database (see db.py)
+# Usage: python migrations.py  (applies any pending migrations and prints the version)
+
+MIGRATIONS = [] # (version, description, function, online) in the order they must be applied
+
+
+def migration(version, description, online=False):
+    # Registers a migration function
+    # Normal migrations run together inside one transaction so either all of them apply or none do
+    # online=True migrations copy data in many small transactions (see rebuild_table) so readers and
+    # writers are never locked out for long, they run on their own after the migrations before them
+    def register(function):
+        MIGRATIONS.append((version, description, function, online))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return function
+    return register
+
+
+def get_version(conn=None):
+    conn = conn or get_connection()
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _set_version(conn, version):
+    # PRAGMA can't take ? parameters so the int() makes sure only a number goes into the SQL
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def migrate(target=None):
+    # Applies every pending migration up to target (the latest by default) and returns the new version
+    conn = get_connection()
+    target = MIGRATIONS[-1][0] if target is None and MIGRATIONS else (target or 0)
+    if get_version(conn) >= target:
+        return get_version(conn) # already up to date, this is the only cost on a normal start up
+    pending = []
+    with transaction() as conn:
+        # re-read the version inside the write lock in case another process migrated first
+        current = get_version(conn)
+        for version, description, function, online in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            if online:
+                pending.append((version, function))
+                break
+            function(conn)
+            _set_version(conn, version)
+    # an online migration ends the single transaction, it is run here and then the rest continue after it
+    for version, function in pending:
+        function(conn)
+        with transaction() as conn:
+            _set_version(conn, version)
+        return migrate(target)
+    return get_version(conn)
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def add_column(conn, table, column, declaration):
+    # ALTER TABLE ADD COLUMN that can be run again safely if the column is already there
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def _has_sequence(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone() is not None
+
+
+def rebuild_table(table, create_sql, select_columns, batch_size=5000, after_swap=None):
+    # Rebuilds a table with a new definition (for example a column type change) while the app keeps running
+    # create_sql creates the new table and must use the placeholder {table} for its name
+    # select_columns are the expressions that turn a row of the old table into a row of the new one
+    # Rows are copied in batches of batch_size by id, each batch in its own short transaction,
+    # and triggers copy any writes that happen to the old table during the copy
+    # The table must have an INTEGER PRIMARY KEY that is part of select_columns so rows keep their ids
+    conn = get_connection()
+    new_table = f"{table}_rebuild"
+    select = ", ".join(select_columns)
+    with transaction() as conn:
+        # leftovers of a rebuild that was interrupted are thrown away and it starts again
+        for suffix in ("ins", "upd", "del"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {new_table}_{suffix}")
+        conn.execute(f"DROP TABLE IF EXISTS {new_table}")
+        conn.execute(create_sql.format(table=new_table))
+        # keeps the new table in step with inserts, updates and deletes that happen while we copy
+        conn.execute(f"CREATE TRIGGER {new_table}_ins AFTER INSERT ON {table} BEGIN INSERT OR REPLACE INTO {new_table} SELECT {select} FROM {table} WHERE rowid = NEW.rowid; END")
+        conn.execute(f"CREATE TRIGGER {new_table}_upd AFTER UPDATE ON {table} BEGIN DELETE FROM {new_table} WHERE rowid = OLD.rowid; INSERT OR REPLACE INTO {new_table} SELECT {select} FROM {table} WHERE rowid = NEW.rowid; END")
+        conn.execute(f"CREATE TRIGGER {new_table}_del AFTER DELETE ON {table} BEGIN DELETE FROM {new_table} WHERE rowid = OLD.rowid; END")
+    last_id = 0
+    while True:
+        with transaction() as conn:
+            # the highest id in the next batch, None when everything has been copied
+            upper = conn.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)", (last_id, batch_size)).fetchone()[0]
+            if upper is None:
+                break
+            # OR IGNORE so a row already copied by a trigger (which is newer) is kept
+            conn.execute(f"INSERT OR IGNORE INTO {new_table} SELECT {select} FROM {table} WHERE rowid > ? AND rowid <= ?", (last_id, upper))
+        last_id = upper
+    # Swapping the tables drops the old one, with foreign keys on that would cascade deletes into
+    # the tables that reference it, so they are switched off for this connection during the swap
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with transaction() as conn:
+            # AUTOINCREMENT's high-water mark goes with the old table, kept so ids of deleted rows aren't handed out again
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone() if _has_sequence(conn) else None
+            conn.execute(f"DROP TABLE {table}") # also drops its triggers and indexes
+            conn.execute(f"ALTER TABLE {new_table} RENAME TO {table}")
+            if sequence:
+                conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table))
+            if after_swap:
+                after_swap(conn) # recreate indexes and triggers on the new table
+            broken = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if broken:
+                raise RuntimeError(f"rebuild of {table} would break {len(broken)} foreign keys")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+
+
+def backfill_column(table, column, expression, batch_size=5000):
+    # Fills in a new column for the rows that already exist, batch_size rows per short transaction
+    # so the app can keep writing while a large table is backfilled (rows written in the meantime
+    # should be handled by a trigger created before this runs)
+    # Returns the number of rows updated
+    conn = get_connection()
+    last_id, total = 0, 0
+    while True:
+        with transaction() as conn:
+            upper = conn.execute(f"SELECT MAX(rowid) FROM (SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?)", (last_id, batch_size)).fetchone()[0]
+            if upper is None:
+                return total
+            total += conn.execute(f"UPDATE {table} SET {column} = {expression} WHERE rowid > ? AND rowid <= ? AND {column} IS NULL", (last_id, upper)).rowcount
+        last_id = upper
+
+
+# Indexes for the hot queries on user_workouts
+# Each one lists the columns in the order the query filters and sorts by, followed by the columns it reads
+# so sqlite can answer the query from the index alone (a covering index) without touching the table
+WORKOUT_INDEXES = {
+    # get_workout_data and get_exercise_list: WHERE student_id AND exercise ORDER BY datetime
+    # (ts and is_bodyweight are read by workout_series.fetch_series and batch_predictor.py)
+    "idx_workouts_series": "user_workouts(student_id, exercise, datetime, reps, weight, ts, is_bodyweight)",
+    # get_workout_history and get_workout_page: WHERE student_id ORDER BY datetime
+    # id straight after datetime so the history pages (keyset on datetime, id) come out of the index in order
+    "idx_workouts_history": "user_workouts(student_id, datetime, id, exercise, reps, weight, is_bodyweight)",
+    # show_leaderboard: GROUP BY student and exercise, also filtered by exercise alone
+    "idx_workouts_exercise": "user_workouts(exercise, student_id, datetime, reps)",
+}
+
+
+def create_indexes(conn, indexes=WORKOUT_INDEXES):
+    # Creates any of the managed indexes that don't exist yet
+    for name, definition in indexes.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+
+@migration(1, "users and user_workouts tables")
+def create_base_tables(conn):
+    # Creates users table to store all users informaation with name and password, student_id is the unique identifier
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users(
+        student_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        password TEXT NOT NULL
+     )
+    """)
+    # Creates the user workouts table to store all workout entries for each user
+    # with a join to users table on the foreign key of student_id
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_workouts (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           student_id INTEGER NOT NULL,
+           exercise TEXT NOT NULL,
+           reps INTEGER NOT NULL,
+           weight REAL NOT NULL,
+           is_bodyweight INTEGER NOT NULL,
+           datetime TEXT DEFAULT CURRENT_TIMESTAMP,
+           FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
+        )
+    """)
+
+
+@migration(2, "covering indexes for the hot user_workouts queries")
+def add_workout_indexes(conn):
+    # the indexes as they were at this version, migrations 7, 8 and 9 change some of them
+    create_indexes(conn, {
+        "idx_workouts_series": "user_workouts(student_id, exercise, datetime, reps, weight)",
+        "idx_workouts_history": "user_workouts(student_id, datetime, exercise, reps, weight, is_bodyweight)",
+        "idx_workouts_exercise": "user_workouts(exercise, student_id, datetime, reps)",
+    })
+
+
+@migration(3, "house column on users and the user_goals table used by user.py")
+def add_user_profile(conn):
+    add_column(conn, "users", "house", "TEXT")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS user_goals (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           student_id INTEGER NOT NULL,
+           exercise TEXT NOT NULL,
+           target_reps INTEGER,
+           target_weight REAL,
+           FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_goals_student ON user_goals(student_id, exercise)")
+
+
+@migration(4, "predictions table written by batch_predictor.py")
+def add_predictions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS predictions (
+           student_id INTEGER NOT NULL,
+           exercise TEXT NOT NULL,
+           day INTEGER NOT NULL,
+           reps REAL NOT NULL,
+           weight REAL NOT NULL,
+           reps_ci REAL NOT NULL,
+           weights_ci REAL NOT NULL,
+           user_level TEXT NOT NULL,
+           generated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (student_id, exercise, day),
+           FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    """)
+
+
+@migration(5, "workout_stats running sums kept up to date by triggers")
+def add_workout_stats(conn):
+    from workout_stats import create_stats_schema, rebuild_stats
+    create_stats_schema(conn)
+    rebuild_stats() # fills in the sums for workouts logged before this migration
+
+
+@migration(6, "leaderboard_stats rollup kept up to date by triggers")
+def add_leaderboard_stats(conn):
+    from leaderboard import create_leaderboard_schema, rebuild_leaderboard
+    create_leaderboard_schema(conn)
+    rebuild_leaderboard() # fills in the rollup for workouts logged before this migration
+
+
+
+# Keep user_workouts.ts in step with the datetime text for every insert and update, whichever program writes it
+# A datetime sqlite can't read would leave ts NULL and break every reader of ts, so the write is refused instead
+_CHECK_DATETIME = f"SELECT RAISE(ABORT, 'invalid datetime, expected YYYY-MM-DD HH:MM:SS') WHERE {epoch_sql('NEW.datetime')} IS NULL;"
+TS_TRIGGERS = {
+    "trg_workouts_ts_insert": f"AFTER INSERT ON user_workouts WHEN NEW.ts IS NULL BEGIN {_CHECK_DATETIME} UPDATE user_workouts SET ts = {epoch_sql('NEW.datetime')} WHERE id = NEW.id; END",
+    "trg_workouts_ts_update": f"AFTER UPDATE OF datetime ON user_workouts BEGIN {_CHECK_DATETIME} UPDATE user_workouts SET ts = {epoch_sql('NEW.datetime')} WHERE id = NEW.id; END",
+}
+
+
+@migration(7, "user_workouts.ts epoch seconds column", online=True)
+def add_workout_epoch(conn):
+    # Online: the backfill runs in batches so a big table isn't locked while every row is converted
+    with transaction() as conn:
+        add_column(conn, "user_workouts", "ts", "INTEGER")
+        for name, body in TS_TRIGGERS.items(): # created first so rows written during the backfill get ts too
+            conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    backfill_column("user_workouts", "ts", epoch_sql("datetime"))
+    with transaction() as conn:
+        conn.execute("DROP INDEX IF EXISTS idx_workouts_series")
+        conn.execute("CREATE INDEX idx_workouts_series ON user_workouts(student_id, exercise, datetime, reps, weight, ts)")
+
+
+@migration(8, "is_bodyweight in idx_workouts_series for the columnar series reads")
+def add_bodyweight_to_series_index(conn):
+    conn.execute("DROP INDEX IF EXISTS idx_workouts_series")
+    conn.execute("CREATE INDEX idx_workouts_series ON user_workouts(student_id, exercise, datetime, reps, weight, ts, is_bodyweight)")
+
+
+@migration(9, "id after datetime in idx_workouts_history for the paged history view")
+def add_id_to_history_index(conn):
+    conn.execute("DROP INDEX IF EXISTS idx_workouts_history")
+    # pinned like migration 2 so a later change to WORKOUT_INDEXES can't change what this migration creates
+    conn.execute("CREATE INDEX idx_workouts_history ON user_workouts(student_id, datetime, id, exercise, reps, weight, is_bodyweight)")
+
+
+@migration(10, "ts triggers refuse a datetime that can't be converted")
+def check_datetime_in_ts_triggers(conn):
+    for name, body in TS_TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {body}")
+
+
+
+@migration(11, "user_workouts.datetime without the UTC CURRENT_TIMESTAMP default", online=True)
+def drop_utc_datetime_default(conn):
+    # Every writer stores Hong Kong time text, but the column's DEFAULT CURRENT_TIMESTAMP filled in UTC for an insert
+    # that left datetime out, and ts (worked out as Hong Kong time) came out 8 hours off; with no default such an
+    # insert leaves datetime NULL and the ts trigger refuses it
+    # SQLite can't change a default in place, so the table is rebuilt online and its indexes and triggers are
+    # put back exactly as they were
+    attached = [sql for (sql,) in conn.execute("SELECT sql FROM sqlite_master WHERE tbl_name = 'user_workouts' AND type IN ('index', 'trigger') AND sql IS NOT NULL")]
+    def restore(conn):
+        for sql in attached:
+            conn.execute(sql)
+    rebuild_table("user_workouts", """
+        CREATE TABLE {table} (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           student_id INTEGER NOT NULL,
+           exercise TEXT NOT NULL,
+           reps INTEGER NOT NULL,
+           weight REAL NOT NULL,
+           is_bodyweight INTEGER NOT NULL,
+           datetime TEXT,
+           ts INTEGER,
+           FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
+        )
+    """, ["id", "student_id", "exercise", "reps", "weight", "is_bodyweight", "datetime", "ts"], after_swap=restore)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import db
+        db.configure(sys.argv[1]) # optional path to a database other than fitness.db
+    print(f"fitness.db schema version {migrate()} of {MIGRATIONS[-1][0]}")
@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+from multiprocessing import Pool, TimeoutError
+import db
+from predictor import get_workout_data, predict_targets, predict_targets_from_stats, plot_predictions
+
+# Runs the forecasts (and optionally plot_predictions) for a whole cohort across several processes
+# Without charts a forecast is solved from the workout_stats sums, the history is only read to draw a chart
+# Work units are (student_id, exercise) pairs, they are sent to the workers in chunks and every worker
+# opens its own read-only connection to the database
+# Results always come back in the same order as the units, whatever order the workers finish in
+# Usage: python parallel_forecast.py [workers] [chunk size]
+
+WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 16 # units per task sent to a worker
+TASK_TIMEOUT = 60 # seconds per unit used to work out how long a chunk may take (see run_forecasts)
+
+
+def _init_worker(db_path):
+    # Runs once in each worker process
+    db.configure(db_path, read_only=True)
+
+
+def _forecast_unit(student_id, exercise, user_level, degree, render):
+    if not render:
+        return predict_targets_from_stats(student_id, exercise, user_level, degree)
+    dates, reps, weights = get_workout_data(student_id, exercise)
+    result = predict_targets(dates, reps, weights, user_level, degree)
+    if result:
+        # charts.py draws off screen and reuses one figure per worker, so many charts don't add up in memory
+        days, future_days, future_reps, future_weights, reps_ci, weights_ci, level = result
+        plot_predictions(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, level)
+    return result
+
+
+def _run_chunk(units, user_level, degree, render):
+    # Returns (result, error message) for every unit in the chunk, one failure doesn't lose the others
+    results = []
+    for student_id, exercise in units:
+        try:
+            results.append((_forecast_unit(student_id, exercise, user_level, degree, render), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def all_units():
+    # Every (student_id, exercise) pair that has workouts, in a fixed order
+    cursor = db.get_connection().execute("SELECT DISTINCT student_id, exercise FROM user_workouts ORDER BY student_id, exercise")
+    return cursor.fetchall()
+
+
+def run_forecasts(units=None, workers=WORKERS, chunk_size=CHUNK_SIZE, task_timeout=TASK_TIMEOUT, user_level="intermediate", degree=2, render=False):
+    # Returns a list of (student_id, exercise, result, error) in the same order as units
+    # result is what predict_targets returned (None when there isn't enough data), error is None or a message
+    # task_timeout bounds the run approximately, it isn't a timeout for each unit: chunk i may finish up to
+    # task_timeout * (units in it) * (i // workers + 1) seconds after the start, which assumes the chunks go out
+    # in rounds of `workers`; a worker that frees up early takes the next chunk sooner, so a slow chunk can
+    # be given a little more time than its own units add up to, but the run never waits longer than the
+    # deadline of the last chunk
+    units = list(all_units() if units is None else units)
+    chunks = [units[i:i + chunk_size] for i in range(0, len(units), chunk_size)]
+    output = []
+    # a multiprocessing.Pool rather than ProcessPoolExecutor because terminate() can stop a worker stuck in a chunk
+    pool = Pool(processes=workers, initializer=_init_worker, initargs=(db.DB_PATH,))
+    timed_out = False
+    try:
+        start = time.monotonic()
+        tasks = [pool.apply_async(_run_chunk, (chunk, user_level, degree, render)) for chunk in chunks]
+        deadlines = [None if task_timeout is None else start + task_timeout * len(chunk) * (i // workers + 1) for i, chunk in enumerate(chunks)]
+        # collecting in submission order is what makes the output order deterministic
+        for chunk, task, deadline in zip(chunks, tasks, deadlines):
+            try:
+                results = task.get(None if deadline is None else max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                timed_out = True
+                results = [(None, "timed out")] * len(chunk)
+            except Exception as e: # _run_chunk catches errors per unit, this is e.g. a result that couldn't be sent back
+                results = [(None, f"{type(e).__name__}: {e}")] * len(chunk)
+            output.extend((student_id, exercise, result, error) for (student_id, exercise), (result, error) in zip(chunk, results))
+    finally:
+        if timed_out:
+            pool.terminate() # stops the workers, waiting for them would wait for the stuck chunk
+        else:
+            pool.close()
+        pool.join()
+    return output
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else CHUNK_SIZE
+    start = time.perf_counter()
+    results = run_forecasts(workers=workers, chunk_size=chunk_size)
+    failed = sum(1 for r in results if r[3])
+    print(f"{len(results)} forecasts ({failed} failed) with {workers} workers in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,113 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from db import get_connection, on_workouts_changed
+from chart_cache import copy_chart, prediction_chart, prediction_filename, prediction_key
+from predictor import get_workout_data, predict_targets_from_stats
+from timestamps import days_since_first
+from workout_stats import get_stats
+
+# Memoized predictions so showing the same forecast again doesn't solve it again
+# The forecast comes from the workout_stats sums (predictor.predict_targets_from_stats), the history isn't read
+# Entries are keyed by (student_id, exercise, degree, user_level, watermark) where the watermark is the series'
+# whole workout_stats row (count, running sums, min/max and latest workout); the triggers update that row on
+# every insert, delete or edit of a workout, so a change written by another program gives a new key too
+# An entry also remembers the chart_cache key of its chart once one is drawn, so showing it again copies the
+# PNG out of chart_cache without reading the workouts or hashing them
+# The write functions in database.py, workouts.py, user.py and gui.py also drop entries straight away
+# through db.workouts_changed()
+
+MAX_ENTRIES = 256
+MAX_BYTES = 32 * 1024 * 1024 # rough memory limit for everything in the cache
+
+_cache = OrderedDict() # key -> [size in bytes, value, chart key or None], oldest first
+_bytes = 0
+_lock = threading.Lock() # the dashboard calls this from background threads
+
+
+def history_watermark(student_id, exercise):
+    # One primary key lookup in workout_stats, None when the student has no workouts of this exercise
+    # The number of workouts comes first, followed by the rest of the row
+    cursor = get_connection().execute("SELECT n, * FROM workout_stats WHERE student_id = ? AND exercise = ?", (student_id, exercise))
+    return cursor.fetchone()
+
+
+def _size(value):
+    # Approximate memory used by a cached value (numpy arrays plus about 64 bytes per list item)
+    size = 0
+    for item in value:
+        if isinstance(item, np.ndarray):
+            size += item.nbytes
+        elif isinstance(item, (list, tuple)):
+            size += _size(item) + 64 * len(item)
+        else:
+            size += 64
+    return size
+
+
+def _evict():
+    # Drops the least recently used entries until the cache is within both limits
+    global _bytes
+    while _cache and (len(_cache) > MAX_ENTRIES or _bytes > MAX_BYTES):
+        _, (size, _, _) = _cache.popitem(last=False)
+        _bytes -= size
+
+
+def _entry(student_id, exercise, user_level, degree):
+    # Returns (key, entry) for the series, computing the forecast on a miss
+    global _bytes
+    watermark = history_watermark(student_id, exercise)
+    if watermark and watermark[-1]: # dirty, get_stats rebuilds it so the key is the row the forecast will use
+        get_stats(student_id, exercise)
+        watermark = history_watermark(student_id, exercise)
+    key = (student_id, exercise, degree, user_level, watermark)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key) # most recently used
+            return key, _cache[key]
+    value = (watermark[0] if watermark else 0, predict_targets_from_stats(student_id, exercise, user_level, degree))
+    entry = [_size(value), value, None]
+    with _lock:
+        if key not in _cache:
+            _cache[key] = entry
+            _bytes += entry[0]
+            _evict()
+        return key, _cache.get(key, entry)
+
+
+def cached_prediction(student_id, exercise, user_level="intermediate", degree=2):
+    # Returns (number of workouts, result) where result is what predict_targets_from_stats returned
+    return _entry(student_id, exercise.lower(), user_level, degree)[1][1]
+
+
+def cached_prediction_chart(student_id, exercise, user_level="intermediate", degree=2):
+    # Returns (number of workouts, result, chart file name) like cached_prediction plus the saved chart
+    # (None when there is no prediction); the workouts are only read the first time the chart is drawn
+    exercise = exercise.lower()
+    _, entry = _entry(student_id, exercise, user_level, degree)
+    (count, result), chart = entry[1], entry[2]
+    if not result:
+        return count, None, None
+    _, future_days, future_reps, future_weights, reps_ci, weights_ci, level = result
+    filename = prediction_filename(student_id, exercise, level)
+    if chart is not None and copy_chart(chart, filename):
+        return count, result, filename
+    dates, reps, weights = get_workout_data(student_id, exercise)
+    days = days_since_first(dates)
+    chart = prediction_key(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, level)
+    prediction_chart(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, level, path=filename, key=chart)
+    entry[2] = chart
+    return count, result, filename
+
+
+@on_workouts_changed
+def invalidate(student_id=None, exercise=None):
+    # Drops every entry for the student and exercise (None matches everything)
+    global _bytes
+    with _lock:
+        for key in [k for k in _cache if (student_id is None or k[0] == student_id) and (exercise is None or k[1] == exercise.lower())]:
+            _bytes -= _cache.pop(key)[0]
+
+
+def clear():
+    invalidate()
@@ -1,259 +1,187 @@
-import sqlite3
 import numpy as np
-import matplotlib.pyplot as plt
-from datetime import datetime
 import schedule
 import time
+from workout_series import fetch_series
+from snapshot import snapshot_series
+from chart_cache import prediction_chart, prediction_filename
+from workout_stats import get_stats, STATS_DEGREE
+from leaderboard import leaderboard_page
+from timestamps import to_datetime64, days_since_first
 
 
 # Get workout history for a student and exercise
-def get_workout_data(student_id, exercise):
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-    cursor.execute(" SELECT datetime, reps, weight FROM user_workouts WHERE student_id = ? AND exercise = ? ORDER BY datetime ASC ", (student_id, exercise.lower()))
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
-        return [], [], []
-
-    dates = [datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S") for row in rows]
-    reps =  [row[1] for row in rows]
-    weights = [row[2] for row in rows]
-    return dates, reps, weights
+# Returns numpy arrays: dates (datetime64, Hong Kong time), reps and weights
+# Read column by column through workout_series.fetch_series, so no date string is parsed and no list of rows is built
+# With a snapshot (snapshot.load_snapshot()) the arrays are slices of the memory-mapped files instead
+# and the database isn't read at all
+def get_workout_data(student_id, exercise, snapshot=None):
+    series = snapshot_series(snapshot, student_id, exercise) if snapshot is not None else fetch_series(student_id, exercise)
+    return to_datetime64(series.ts), series.reps, series.weight
    # Polynomial Regression Algorithm
-def polynomial_regression(x_values, y_values, degree=2):
-    # First step is to create the design matrix where each row 
-    # corresponds to a power of x (days since first workout)
-    # works out exact numbers for the curve to match the data closely
-    X = [[x**i for i in range(degree+1)]for x in x_values]
-    XT = list(map(list, zip(*X))) # swap rows and columns in matrix X
-    XT_X = [[sum(a*b for a, b in zip(row, col))for col in zip(*X)] for row in XT]
-    # The code above just multiplies matrix XT with matrix X
-    XT_y = [sum(a*b for a, b in zip(row, y_values)) for row in XT]
-    # The code above multiplies matrix XT with vector y_values
-    coeffs = gaussian_elimination(XT_X, XT_y)
-    return coeffs
+# Least squares fit of a polynomial to one or more targets in one call
+# y_values can be a single list or a matrix with one column per target (e.g. reps and weights stacked)
+# so both curves share the same design matrix and are solved together
+def fit_polynomials(x_values, y_values, degree=2):
+    x = np.asarray(x_values, dtype=float)
+    y = np.asarray(y_values, dtype=float)
+    # x is scaled to [-1, 1] before taking powers, otherwise x**2 for long histories is huge compared
+    # to the constant column and the fit becomes ill-conditioned
+    scale = max(np.abs(x).max(initial=0.0), 1.0)
+    # Design matrix where each column is a power of x (days since first workout): 1, x, x^2, ...
+    X = np.vander(x / scale, degree + 1, increasing=True)
+    # lstsq solves with an SVD so it copes with singular cases like every workout on the same day
+    # (it returns the smallest solution instead of dividing by a zero pivot)
+    coeffs = np.linalg.lstsq(X, y, rcond=None)[0]
+    powers = scale ** np.arange(degree + 1)
+    # undo the scaling so the coefficients work on unscaled days
+    return coeffs / (powers if coeffs.ndim == 1 else powers[:, None])
 
-# Solve equations using the Gaussian elimination model
-# Performs forward elimination and back substitution 
-# Solves system of equations
+def polynomial_regression(x_values, y_values, degree=2):
+    # Coefficients [a0, a1, a2, ...] for a single target
+    return list(fit_polynomials(x_values, y_values, degree))
 
+# Solve equations A x = b (used for normal equations built from stored sums)
+# A singular or nearly singular system gets the least squares answer instead of a division by zero
 def gaussian_elimination(A, b):
-    n = len(A)
-    # Forward elimination to reduce matrix to upper triangular form
-    for i in range(n):
-        pivot = A[i][i] # diagonal element used to eliminate below
-        # Scale the pivot row so pivot becomes 1
-        for J in range(i, n): 
-            A[i][J] /= pivot
-        b[i] /=pivot
-            # Eliminate the current variable from all rows below
-        for k in range (i+1, n):
-            factor = A[k][i]
-            for J in range(i, n):
-                A[k][J] -= factor * A[i][J]
-            b[k] -= factor * b[i]
-    # Back substitutiion to solvefor each coefficient
-    # Starts from the bottom row and works upwards
-    x = [0]*n
-    for i in range(n-1, -1, -1):
-        # Each row now has fewer variables to solve for
-        x[i] = b[i] - sum(A[i][J] * x[J] for J in range (i+1, n))
-    return x
+    return list(np.linalg.lstsq(np.asarray(A, dtype=float), np.asarray(b, dtype=float), rcond=None)[0])
 
 # Predicts the new values using polynomial coefficients
-# Given the coefficients and x value 
+# Given the coefficients and x value (or an array of x values)
 # Calculates y = a0 + a1*x + a2*x^2 + ...
 def predict(coeffs, x):
-    return sum(coeffs[i] * (x**i) for i in range(len(coeffs)))
+    return np.polyval(np.asarray(coeffs, dtype=float)[::-1], x)
 
 
 
 
 
-# predict future reps and weight using Polynomial regression and user level implementation
-# Configures user level based on performance
-def predict_targets(dates, reps, weights, user_level="intermediate", degree=2):
-    if len(dates) < 2: # If less than 2 workouts are logged
-        return None # Not enough data to make an accurate prediction
-    # This function allowws dates to be converted into days since first workout
-    days = np.array([(d - dates[0]).days for d in dates])
-    future_days = np.arange(days[-1] + 1, days[-1] + 6)
-    #  +6 to predict the next 5 days weekly predictions
-    # Polynomial REGRESSION FOR Reps and weighrs
-    # get the coeffs for reps and weights
-    reps_coeffs = polynomial_regression(days, reps, degree)
-    weights_coeffs = polynomial_regression(days, weights, degree)
+# Caps on reps and weights for each user level (anything else is treated as intermediate)
+LEVEL_LIMITS = {"intermediate": (150, 70), "expert": (200, 90)}
 
-    # Predictions for reps and weight in the future days
-
-    future_reps = np.array([predict(reps_coeffs, d) for d in future_days], dtype=float)
-    future_weights = np.array([predict(weights_coeffs, d) for d in future_days], dtype=float)
-    # Clamp predictions so they never go below last actual values
-    # Ensures reps and weights stay non negative
-    last_reps = reps[-1]
-    last_weights = weights[-1]
+def level_limits(user_level):
+    return LEVEL_LIMITS.get(user_level, LEVEL_LIMITS["intermediate"])
 
-   
-
-    # basic if condition if user achieves 90% of the max reps or weights
-   # They can ugrade to the next level
-    
-    if user_level == "intermediate":
-        max_reps, max_weights = 150, 70
-    elif user_level == "expert":
-        max_reps, max_weights = 200, 90
-    else: # user level is defaulted to intermediate
-        max_reps, max_weights = 150, 70
 # Trade off ensures that if weights increase for an exercise
 # Reps will be reduced proportionally 
 # This fully reflects real training as when weights increase reps may decrease
-   
-    for i in range(len(future_days)):
-        
-
+# Works on one forecast (one value per future day) or on many forecasts at once (one row per series),
+# last_reps and last_weights are then one value per row
+def apply_training_rules(future_reps, future_weights, last_reps, last_weights, user_level="intermediate"):
+    max_reps, max_weights = level_limits(user_level)
+    future_reps = np.array(future_reps, dtype=float)
+    future_weights = np.array(future_weights, dtype=float)
+    for i in range(future_reps.shape[-1]):
+        r = future_reps[..., i]
+        w = future_weights[..., i]
         # There should be atrade off when it comes to predictions
         # I came up with rules that can accomodate for this style of training
         # First if weights  are low reps will also dip
-        if future_weights[i] < max_weights * 0.5:
-            future_reps[i] *= 0.85
-            future_weights[i] *= 1.08
+        low = w < max_weights * 0.5
+        r, w = np.where(low, r * 0.85, r), np.where(low, w * 1.08, w)
         # If weights are high reps will aso increase
-        if future_weights[i] > max_weights * 0.7:
-            future_reps[i] *= 1.05
-            future_weights[i] *= 0.97
+        high = w > max_weights * 0.7
+        r, w = np.where(high, r * 1.05, r), np.where(high, w * 0.97, w)
         # If reps are low weights will decrease
-        if future_reps[i] < max_reps * 0.4:
-            future_weights[i] *= 1.06
-            future_reps[i] *= 0.95
+        low = r < max_reps * 0.4
+        r, w = np.where(low, r * 0.95, r), np.where(low, w * 1.06, w)
         # If reps are high weights will increase
-        if future_reps[i] > max_reps * 0.7:
-            future_weights[i] *= 1.06
-            future_reps[i] *= 0.95
+        high = r > max_reps * 0.7
+        r, w = np.where(high, r * 0.95, r), np.where(high, w * 1.06, w)
         # Fatigue Cycle : every 3rd prediction reps dip slightly
         if i % 3 == 0:
-            future_reps[i] *= 0.90
-        
-    min_reps = last_reps * 0.7
-    min_weights = last_weights * 0.7
+            r = r * 0.90
+        future_reps[..., i] = r
+        future_weights[..., i] = w
+    # Clamp predictions so they never go below 70% of the last actual values
+    # Ensures reps and weights stay non negative
+    min_reps = np.asarray(last_reps, dtype=float)[..., None] * 0.7
+    min_weights = np.asarray(last_weights, dtype=float)[..., None] * 0.7
     future_reps = np.clip(future_reps, min_reps, max_reps)
     future_weights = np.clip(future_weights, min_weights, max_weights)
-  
-   
+    return future_reps, future_weights
+
+# True when the last workout is at 90% of the level's max reps or weights (one value per series for arrays)
+def reached_next_level(last_reps, last_weights, user_level="intermediate"):
+    max_reps, max_weights = level_limits(user_level)
+    return (np.asarray(last_reps) >= 0.9 * max_reps) | (np.asarray(last_weights) >= 0.9 * max_weights) # sets 90% threshold
+
+# predict future reps and weight using Polynomial regression and user level implementation
+# Configures user level based on performance
+def predict_targets(dates, reps, weights, user_level="intermediate", degree=2):
+    if len(dates) < 2: # If less than 2 workouts are logged
+        return None # Not enough data to make an accurate prediction
+    # This function allowws dates to be converted into days since first workout
+    days = days_since_first(dates)
+    future_days = np.arange(days[-1] + 1, days[-1] + 6)
+    #  +6 to predict the next 5 days weekly predictions
+    # Polynomial REGRESSION FOR Reps and weighrs
+    # get the coeffs for reps and weights in one fit, column 0 is reps and column 1 is weights
+    coeffs = fit_polynomials(days, np.column_stack([reps, weights]), degree)
+
+    # Predictions for reps and weight in the future days
+    future = np.vander(future_days.astype(float), degree + 1, increasing=True) @ coeffs
+    future_reps = future[:, 0].copy()
+    future_weights = future[:, 1].copy()
+    # Trade off rules and clamping, shared with the batch forecasts in batch_predictor.py
+    future_reps, future_weights = apply_training_rules(future_reps, future_weights, reps[-1], weights[-1], user_level)
 
-    if reps[-1] >= 0.9 * max_reps or weights[-1] >= 0.9 * max_weights: # sets 90% threshold
+    # basic if condition if user achieves 90% of the max reps or weights
+   # They can ugrade to the next level
+    if reached_next_level(reps[-1], weights[-1], user_level):
         user_level = "expert"
-        max_reps, max_weights = 150, 70
     # Makes sure that these predictions are capped at a certain level
     
   
     # Next we calculate the 95% confidence intervals
     # this shows that these predictions are approximations
     # not certain values just to help users to plan workouts
-    reps_ci = 1.96 * (max(reps) - min(reps)) / max(len(reps), 1)
-    weights_ci = 1.96 * (max(weights) - min(weights)) / max(len(weights), 1)
+    reps_ci = 1.96 * np.ptp(reps) / max(len(reps), 1)
+    weights_ci = 1.96 * np.ptp(weights) / max(len(weights), 1)
  
     return days, future_days, future_reps, future_weights, reps_ci, weights_ci, user_level
 
-# actual vs  prediction plot
+# Same forecast as predict_targets but solved from the running sums in workout_stats (see workout_stats.py)
+# so the cost doesn't grow with the number of workouts logged
+# The history itself isn't read, so days (the first value returned) is None
+def predict_targets_from_stats(student_id, exercise, user_level="intermediate", degree=2):
+    stats = None if degree > STATS_DEGREE else get_stats(student_id, exercise.lower())
+    if degree > STATS_DEGREE or (stats is not None and stats["dirty"]):
+        # the stored sums only go up to degree 2, and a dirty row (read-only connection) is out of date
+        return predict_targets(*get_workout_data(student_id, exercise), user_level, degree)
+    if stats is None or stats["n"] < 2: # If less than 2 workouts are logged
+        return None # Not enough data to make an accurate prediction
+    last_day = stats["last_day"]
+    future_days = np.arange(last_day + 1, last_day + 6)
+    # The normal equations XT_X c = XT_y built from the sums, with days scaled to [0, 1] like fit_polynomials
+    scale = max(last_day, 1)
+    power_sums = [stats["n"]] + [stats[f"sx{k}"] / scale**k for k in range(1, 2 * degree + 1)]
+    XT_X = [[power_sums[i + j] for j in range(degree + 1)] for i in range(degree + 1)]
+    XT_y = [[stats[f"sr{k}"] / scale**k, stats[f"sw{k}"] / scale**k] for k in range(degree + 1)]
+    coeffs = np.array(gaussian_elimination(XT_X, XT_y))
+    future = np.vander(future_days / scale, degree + 1, increasing=True) @ coeffs
+    future_reps, future_weights = apply_training_rules(future[:, 0], future[:, 1], stats["last_reps"], stats["last_weight"], user_level)
+    if reached_next_level(stats["last_reps"], stats["last_weight"], user_level):
+        user_level = "expert"
+    reps_ci = 1.96 * (stats["max_reps"] - stats["min_reps"]) / stats["n"]
+    weights_ci = 1.96 * (stats["max_weight"] - stats["min_weight"]) / stats["n"]
+    return None, future_days, future_reps, future_weights, reps_ci, weights_ci, user_level
 
+# actual vs  prediction plot
+# Rendered off screen by charts.py (Agg, one reused figure) and saved as a png, returns the file name
+# chart_cache.py serves the same chart from its folder without drawing it if the data hasn't changed
+# Nothing is shown here so it never blocks, the GUI opens the saved file instead
 def plot_predictions(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level="intermediate"):
-    plt.figure(figsize=(12, 5))
-# Now we must create two subplots: one for reps and one for weights
-    # reps plot
-    plt.subplot(1, 2, 1)
-    # subplot 1 
-    plt.plot(days, reps, label = "Actual Reps", marker='o') 
-    # actual reps will be shown as dots
-    plt.plot(future_days, future_reps, label="predicted Reps", linestyle='--', marker='x')
-    # predicted reps will have a dashed linestyle and be shown as x marks
-    plt.fill_between(future_days, [r-reps_ci for r in future_reps], [r+reps_ci for r in future_reps], color='gray', alpha=0.2, label="95% CI")
-    # mkes the confidence interval shaded gray for the graph
-    plt.title(f"Reps Prediction for {exercise.capitalize()} ({user_level.capitalize()} Level)")
-    # Title of the graph for specific exercise including user level
-    plt.xlabel("Days since first workout")
-    # Shows x axis label as days since first workout
-    plt.ylabel("Reps")
-    # Shows y axis label as reps
-    plt.grid(True, linestyle="--", alpha=0.6)
-    plt.legend()
-
-    # weight plot
-
-    plt.subplot(1, 2, 2)
-    # Subplot 2
-    plt.plot(days, weights, label="Actual Weight", marker='o')
-    plt.plot(future_days, future_weights, label="predicted weight", linestyle='--', marker='x')
-    lower_weights = np.maximum.accumulate(future_weights - weights_ci)
-    upper_weights = future_weights + weights_ci
-    plt.fill_between(future_days.flatten(), lower_weights, upper_weights, color='red', alpha=0.2, label="95% CI")
-    plt.title(f"Weight Prediction for {exercise.capitalize()} ({user_level.capitalize()} Level)")
-    plt.xlabel("Days since first workout")
-    plt.ylabel("Weight (Kg)")
-    plt.grid(True, linestyle="--", alpha=0.6)
-    plt.legend()
-
-    plt.tight_layout()
-    # makes the plot fit in one page
-    plt.savefig(f"prediction_{student_id}_{exercise}_{user_level}.png")
-    # Allows user to save plot as a png
-    plt.show()
-
-    return future_days, future_reps, future_weights, reps_ci, weights_ci
+    filename = prediction_filename(student_id, exercise, user_level)
+    return prediction_chart(days, reps, weights, future_days, future_reps, future_weights, reps_ci, weights_ci, exercise, student_id, user_level, path=filename)
 
     # Leaderboard displays
 
-def show_leaderboard(student_id=None, exercise_filter=None):
-    conn = sqlite3.connect("fitness.db") # connect to the database 
-    cursor = conn.cursor()
-
-    query = """
-        SELECT u.student_id, u.name, w.exercise, MIN(w.datetime), MAX(w.datetime), MIN(w.reps), MAX(w.reps)
-        FROM user_workouts w
-        JOIN users u on u.student_id = w.student_id
-    """
-    # query to collect user's exercise history from database for leaderboard calculations
-    filters = []
-    params = []
-
-    if student_id is not None:
-        filters.append("u.student_id = ?") # allows user to filter by student_id
-        params.append(student_id) # stores the student id value
-    if exercise_filter is not None: 
-        filters.append("w.exercise = ?") # allows user to filter by exercise
-        params.append(exercise_filter.lower()) # stores exercise name in lower case
-# If any more filters exist join them to the query using WHERE and AND
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
- # groups results by student and exercise to calculate the improvement per exercise
-    query += " GROUP BY u.student_id, w.exercise"
-# execute the querry with the parameters and fetch all matching rows
-    cursor.execute(query, tuple(params))
-    rows = cursor.fetchall()
-    conn.close()
-
-    leaderboard = []
- # Process each row to calculate improvement rate
-    for student_id, name, exercise, start_date, end_date, min_reps, max_reps in rows:
-      try:
-       # Convert dates into datetime 
-       start = datetime.strptime(start_date, "%Y-%m-%d %H:%M:%S")
-       end = datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
-      # Calculate days between first and latest workout logged (also avoids division by 0)
-       days = max((end - start).days, 1)
-      # Improvement rate calculation
-       rate = (max_reps - min_reps) / days
-      # Add updated student info and improvement rate for the exercise on the leaderboard
-       leaderboard.append((student_id, name, exercise, round(rate, 2)))
-      except ValueError as e:
-    # Skips row if there's an error in date conversion
-          print(f"Skipping row due to error: {e}")
-          continue
-   # sorts leaderboard with highest improvement rate being first
-    leaderboard.sort(key=lambda x: x[3], reverse=True) 
-
-    return leaderboard[: 10]
+def show_leaderboard(student_id=None, exercise_filter=None, limit=10, offset=0):
+    # The improvement rate for every student and exercise is kept up to date in leaderboard_stats
+    # (see leaderboard.py) so this is one page read from an index instead of a GROUP BY over every workout
+    # limit and offset pick the page (the first 10 by default), leaderboard.py also has ranks and per exercise top k
+    page = leaderboard_page(limit, offset, student_id=student_id, exercise=exercise_filter)
+    return [(student_id, name, exercise, round(rate, 2)) for _, student_id, name, exercise, rate in page]
     
 # Daily leaderboard sanpshot
     
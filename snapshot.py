@@ -0,0 +1,164 @@
+import json
+import math
+import os
+import shutil
+import sys
+from collections import namedtuple
+import numpy as np
+from db import get_connection
+from timestamps import DAY
+from workout_series import WorkoutSeries
+
+# Columnar snapshot of user_workouts for analytics (leaderboards, cohort forecasts, charts)
+# One .npy file per column, sorted by (student_id, exercise, ts), plus an offsets index with where each
+# series starts, so a series is a zero-copy slice of arrays opened with np.load(mmap_mode="r")
+# Refreshing only reads the workouts with an id above the watermark stored in meta.json; if workouts up to
+# the watermark were deleted or changed since (seen through their count, sums and per-exercise counts) everything is reread
+# Usage: python snapshot.py [directory] [--full]
+
+SNAPSHOT_DIR = "workout_snapshot"
+FETCH_SIZE = 50000 # rows read from sqlite at a time
+
+COLUMNS = {
+    # column: dtype, everything is one value per workout in snapshot order
+    "id": np.int64,
+    "student_id": np.int64,
+    "exercise": np.int32, # index into meta["exercises"]
+    "ts": np.int64,
+    "day": np.int64, # whole days since the series' first workout
+    "reps": np.int64,
+    "weight": np.float64,
+    "is_bodyweight": np.bool_,
+}
+# offsets index: series i is rows offsets[i]:offsets[i + 1] and belongs to series_student[i], series_exercise[i]
+INDEX_COLUMNS = {"series_student": np.int64, "series_exercise": np.int32, "offsets": np.int64}
+
+Snapshot = namedtuple("Snapshot", ["meta", "columns", "series"]) # series: {(student_id, exercise): (start, end)}
+
+
+def _fingerprint(conn, watermark):
+    # Count and sums of the workouts up to the watermark plus (exercise, count, sum of ids) for every exercise,
+    # a delete or an edit to any column the snapshot keeps changes at least one of them
+    row = conn.execute("SELECT COUNT(*), COALESCE(SUM(student_id), 0), COALESCE(SUM(ts), 0), COALESCE(SUM(reps), 0), COALESCE(SUM(is_bodyweight), 0), TOTAL(weight) FROM user_workouts WHERE id <= ?", (watermark,)).fetchone()
+    exercises = conn.execute("SELECT exercise, COUNT(*), SUM(id) FROM user_workouts WHERE id <= ? GROUP BY exercise", (watermark,)).fetchall()
+    return list(row) + [sorted(exercises)]
+
+
+def _snapshot_fingerprint(columns, exercises):
+    codes = np.asarray(columns["exercise"])
+    counts = np.bincount(codes, minlength=len(exercises))
+    id_sums = np.zeros(len(exercises), dtype=np.int64)
+    np.add.at(id_sums, codes, columns["id"])
+    by_exercise = sorted((exercises[code], int(counts[code]), int(id_sums[code])) for code in np.flatnonzero(counts))
+    return [len(columns["id"]), int(columns["student_id"].sum()), int(columns["ts"].sum()), int(columns["reps"].sum()),
+            int(columns["is_bodyweight"].sum()), float(columns["weight"].sum()), by_exercise]
+
+
+def _same_fingerprint(a, b):
+    # weight is a float total, summed in a different order by sqlite and numpy, so it only has to be close
+    return a[:5] == b[:5] and math.isclose(a[5], b[5], rel_tol=1e-9, abs_tol=1e-6) and a[6] == b[6]
+
+
+def _read_new_rows(conn, watermark, exercises, fetch_size):
+    # Reads the workouts with id > watermark into arrays, new exercise names are added to exercises
+    codes = {name: i for i, name in enumerate(exercises)}
+    chunks = []
+    cursor = conn.execute("SELECT id, student_id, exercise, ts, reps, weight, is_bodyweight FROM user_workouts WHERE id > ? ORDER BY id", (watermark,))
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        ids, student_ids, names, ts, reps, weights, is_bodyweight = zip(*rows)
+        for name in set(names) - codes.keys():
+            codes[name] = len(exercises)
+            exercises.append(name)
+        chunks.append({
+            "id": np.array(ids, dtype=np.int64), "student_id": np.array(student_ids, dtype=np.int64),
+            "exercise": np.array([codes[name] for name in names], dtype=np.int32), "ts": np.array(ts, dtype=np.int64),
+            "reps": np.array(reps, dtype=np.int64), "weight": np.array(weights, dtype=np.float64), "is_bodyweight": np.array(is_bodyweight, dtype=np.bool_),
+        })
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0, dtype=COLUMNS[name]) for name in COLUMNS if name != "day"}
+
+
+def _series_starts(columns):
+    student_ids, exercises = columns["student_id"], columns["exercise"]
+    changes = np.flatnonzero((student_ids[1:] != student_ids[:-1]) | (exercises[1:] != exercises[:-1])) + 1
+    return np.concatenate([[0], changes]) if len(student_ids) else np.empty(0, dtype=np.int64)
+
+
+def _write(directory, meta, columns, index):
+    # Writes into a new folder and swaps it in, so readers never see half a snapshot
+    # (anyone with the old files mapped keeps reading them until they load again)
+    new_directory, old_directory = directory + ".new", directory + ".old"
+    shutil.rmtree(new_directory, ignore_errors=True)
+    os.makedirs(new_directory)
+    for name, array in {**columns, **index}.items():
+        np.save(os.path.join(new_directory, f"{name}.npy"), array)
+    with open(os.path.join(new_directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    shutil.rmtree(old_directory, ignore_errors=True)
+    if os.path.exists(directory):
+        os.rename(directory, old_directory)
+    os.rename(new_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+def refresh_snapshot(directory=SNAPSHOT_DIR, full=False, fetch_size=FETCH_SIZE):
+    # Brings the snapshot up to date with user_workouts and returns its meta data
+    meta = None
+    if not full and os.path.exists(os.path.join(directory, "meta.json")):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+    conn = get_connection()
+    conn.execute("BEGIN") # one read transaction so the checks and the new rows come from the same version of the table
+    try:
+        old = load_snapshot(directory).columns if meta else None
+        if meta and not _same_fingerprint(_fingerprint(conn, meta["watermark"]), _snapshot_fingerprint(old, meta["exercises"])):
+            meta = old = None # workouts below the watermark were deleted or changed, start again
+        if meta is None:
+            meta = {"watermark": 0, "rows": 0, "exercises": []}
+        new = _read_new_rows(conn, meta["watermark"], meta["exercises"], fetch_size)
+    finally:
+        conn.execute("COMMIT")
+    if old is not None and len(new["id"]) == 0:
+        return meta # nothing new
+    if old is not None:
+        new = {name: np.concatenate([old[name], new[name]]) for name in new}
+    # the same order get_workout_data reads a series in (ts is in step with datetime), id settles ties
+    order = np.lexsort((new["id"], new["ts"], new["exercise"], new["student_id"]))
+    columns = {name: array[order] for name, array in new.items()}
+    starts = _series_starts(columns)
+    lengths = np.diff(np.append(starts, len(order)))
+    columns["day"] = (columns["ts"] - np.repeat(columns["ts"][starts], lengths)) // DAY
+    index = {
+        "series_student": columns["student_id"][starts],
+        "series_exercise": columns["exercise"][starts],
+        "offsets": np.append(starts, len(order)).astype(np.int64),
+    }
+    meta = {"watermark": int(columns["id"].max(initial=meta["watermark"])), "rows": len(order), "series": len(starts), "exercises": meta["exercises"]}
+    _write(directory, meta, {name: columns[name] for name in COLUMNS}, index)
+    return meta
+
+
+def load_snapshot(directory=SNAPSHOT_DIR):
+    # Opens a snapshot with every column memory-mapped (read only), nothing is read until it is used
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in list(COLUMNS) + list(INDEX_COLUMNS)}
+    offsets = columns["offsets"]
+    exercises = meta["exercises"]
+    series = {(int(student_id), exercises[code]): (int(offsets[i]), int(offsets[i + 1]))
+              for i, (student_id, code) in enumerate(zip(columns["series_student"].tolist(), columns["series_exercise"].tolist()))}
+    return Snapshot(meta, columns, series)
+
+
+def snapshot_series(snapshot, student_id, exercise):
+    # A WorkoutSeries whose arrays are views into the mapped files (empty if the series isn't in the snapshot)
+    start, end = snapshot.series.get((student_id, exercise.lower()), (0, 0))
+    return WorkoutSeries(*(snapshot.columns[name][start:end] for name in WorkoutSeries._fields))
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--full"]
+    meta = refresh_snapshot(args[0] if args else SNAPSHOT_DIR, full="--full" in sys.argv)
+    print(f"snapshot has {meta['rows']:,} workouts in {meta.get('series', 0):,} series up to id {meta['watermark']}")
@@ -0,0 +1,36 @@
+import threading
+from db import get_connection
+
+# In-memory set of the student ids that are already registered, so the registration window can say whether
+# an id is free while the user types without a database query per keystroke
+# It is read once (load_taken_ids, meant for a background thread) and kept up to date by the app's own
+# register and delete functions; accounts made by another program meanwhile are only caught by the database
+# check when the account is actually created
+
+_taken = None # set of student ids, None until loaded
+_lock = threading.Lock()
+
+
+def load_taken_ids():
+    # Reads every registered id (from the users primary key), does nothing if already loaded
+    global _taken
+    with _lock:
+        if _taken is None:
+            _taken = {student_id for (student_id,) in get_connection().execute("SELECT student_id FROM users")}
+
+
+def is_taken(student_id):
+    # True/False, or None if the ids haven't been loaded yet
+    if _taken is None:
+        return None
+    return student_id in _taken
+
+
+def mark_taken(student_id):
+    if _taken is not None:
+        _taken.add(student_id)
+
+
+def mark_free(student_id):
+    if _taken is not None:
+        _taken.discard(student_id)
@@ -0,0 +1,47 @@
+from datetime import datetime
+
+# Every workout time in the app is Hong Kong local time
+# user_workouts keeps it twice: datetime is the "YYYY-MM-DD HH:MM:SS" text shown in the app and ts is the same
+# moment as Unix epoch seconds (filled in by triggers, see migration 7), which is what predictions read so no
+# date string is parsed when a forecast or chart is made
+# Hong Kong has no daylight saving time so local time is always UTC + 8 hours
+# numpy and pytz are only imported by the functions that use them, the login window imports this file through db.py
+
+TIMEZONE = "Asia/Hong_Kong"
+FORMAT = "%Y-%m-%d %H:%M:%S"
+UTC_OFFSET = 8 * 3600 # seconds
+DAY = 86400 # seconds
+
+
+def now_text():
+    # The current Hong Kong time in the format stored in user_workouts.datetime
+    import pytz
+    return datetime.now(pytz.timezone(TIMEZONE)).strftime(FORMAT)
+
+
+def is_valid_datetime(text):
+    # True for a "YYYY-MM-DD HH:MM:SS" string (the only format the ts trigger and the readers understand)
+    try:
+        datetime.strptime(text, FORMAT)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def epoch_sql(column="datetime"):
+    # SQL expression that turns a stored Hong Kong time string into epoch seconds
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) - {UTC_OFFSET})"
+
+
+def to_datetime64(ts):
+    # Epoch seconds -> numpy datetime64 of the Hong Kong local time (what the app shows and plots)
+    import numpy as np
+    return (np.asarray(ts, dtype=np.int64) + UTC_OFFSET).astype("datetime64[s]")
+
+
+def days_since_first(dates):
+    # Whole days between each workout and the first one, the same as (d - dates[0]).days
+    # dates can be datetime64 values or datetime objects
+    import numpy as np
+    dates = np.asarray(dates, dtype="datetime64[s]")
+    return (dates - dates[0]) // np.timedelta64(1, "D")
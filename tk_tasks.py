@@ -0,0 +1,90 @@
+from tkinter import messagebox
+
+# Runs slow dashboard work (database reads, fitting, chart rendering) on worker threads so Tk stays responsive
+# Tk widgets may only be touched from the main thread, so results are collected by polling with root.after
+# and the callbacks run back on the main thread
+# Every task has a key (e.g. "predictions"); submitting a new task with the same key makes the older one
+# stale: it is cancelled if it hasn't started yet and its result is thrown away if it has
+# While anything is running the window shows a busy cursor and the optional progress bar moves
+
+WORKERS = 2 # the database and numpy release the GIL for most of the heavy work
+POLL_MS = 50 # how often finished tasks are checked for
+
+
+class TaskRunner:
+    def __init__(self, root, progress=None, workers=WORKERS, poll_ms=POLL_MS):
+        self.root = root
+        self.progress = progress # a ttk.Progressbar in indeterminate mode, or None
+        self.poll_ms = poll_ms
+        from concurrent.futures import ThreadPoolExecutor # not needed until the dashboard opens
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashboard")
+        self.running = {} # key -> (future, on_done, on_error) for the latest task with that key
+        self.polling = False
+        self.showing_busy = False
+
+    def submit(self, key, work, on_done, on_error=None):
+        # Runs work() on a worker thread then on_done(result) on the Tk thread
+        # on_error(exception) is called instead if work raised (by default the error is shown in a message box)
+        self.watch(key, self.executor.submit(work), on_done, on_error)
+
+    def watch(self, key, future, on_done, on_error=None):
+        # Same as submit for a Future that is already on its way somewhere else (e.g. a queued workout write)
+        self._drop(key)
+        self.running[key] = (future, on_done, on_error)
+        self._set_busy(True)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def cancel(self, key):
+        # Drops the task for key, it won't call back even if it is already running
+        self._drop(key)
+        if not self.running:
+            self._set_busy(False)
+
+    def _drop(self, key):
+        task = self.running.pop(key, None)
+        if task:
+            task[0].cancel() # only stops it if it hasn't started, otherwise the result is ignored
+
+    def busy(self):
+        return bool(self.running)
+
+    def _poll(self):
+        for key, (future, on_done, on_error) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[key]
+            try:
+                result = future.result()
+            except Exception as e:
+                (on_error or _show_error)(e)
+            else:
+                on_done(result)
+        if self.running:
+            self.root.after(self.poll_ms, self._poll)
+        else:
+            self.polling = False
+            self._set_busy(False)
+
+    def _set_busy(self, busy):
+        if busy == self.showing_busy:
+            return
+        self.showing_busy = busy
+        try:
+            self.root.config(cursor="watch" if busy else "")
+            if self.progress is not None and busy:
+                self.progress.start(10)
+            elif self.progress is not None:
+                self.progress.stop()
+        except Exception:
+            pass # the window is already closed
+
+    def shutdown(self):
+        # Call when the window closes, queued tasks are dropped and running ones finish in the background
+        self.running.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _show_error(e):
+    messagebox.showerror("Error", str(e))
@@ -0,0 +1,203 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import db
+from timestamps import now_text
+from workouts import _row_error
+
+# Streaming import/export of the users and user_workouts tables to CSV or JSONL
+# Rows are read with fetchmany and written in chunked transactions so memory use stays the same for any table size
+# Both directions go in order of the table key (id or student_id) and print the last key they finished,
+# run again with --after-id set to that value to carry on from where a previous run stopped
+#
+# Examples:
+#   python transfer.py export user_workouts workouts.csv --student-id 1234 --since 2025-01-01
+#   python transfer.py export users users.jsonl
+#   python transfer.py import user_workouts workouts.csv --after-id 250000
+
+TABLES = {
+    # table: (key column, columns in file order, type for each column)
+    "users": ("student_id", ["student_id", "name", "password", "house"], [int, str, str, str]),
+    "user_workouts": ("id", ["id", "student_id", "exercise", "reps", "weight", "is_bodyweight", "datetime"], [int, int, str, int, float, int, str]),
+}
+BATCH_SIZE = 5000
+
+
+def _progress(action, table, count, last_key, started):
+    # Progress goes to stderr so stdout can still be piped somewhere else
+    rate = count / max(time.perf_counter() - started, 1e-9)
+    print(f"\r{action} {table}: {count:,} rows ({rate:,.0f} rows/sec), last {TABLES[table][0]} = {last_key}", end="", file=sys.stderr, flush=True)
+
+
+def _file_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+
+
+def _export_query(table, student_id=None, exercise=None, since=None, until=None, after_id=0):
+    key, columns, _ = TABLES[table]
+    filters = [f"{key} > ?"]
+    params = [after_id]
+    if student_id is not None:
+        filters.append("student_id = ?")
+        params.append(student_id)
+    if table == "user_workouts":
+        if exercise is not None:
+            filters.append("exercise = ?")
+            params.append(exercise.lower())
+        if since is not None:
+            filters.append("datetime >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("datetime < ?") # until is exclusive so ranges can be chained
+            params.append(until)
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE {' AND '.join(filters)} ORDER BY {key}"
+    return query, params
+
+
+def export_table(table, path, fmt=None, batch_size=BATCH_SIZE, after_id=0, **filters):
+    # Writes the table (optionally filtered) to path, returns (rows written, last key written)
+    key, columns, _ = TABLES[table]
+    fmt = _file_format(path, fmt)
+    query, params = _export_query(table, after_id=after_id, **filters)
+    # carrying on from an earlier run adds to the end of the file instead of starting again
+    resuming = after_id > 0 and os.path.exists(path)
+    cursor = db.get_connection().execute(query, params)
+    count, last_key, started = 0, after_id, time.perf_counter()
+    with open(path, "a" if resuming else "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer and not resuming:
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+            f.flush()
+            count += len(rows)
+            last_key = rows[-1][0]
+            _progress("exported", table, count, last_key, started)
+    print(file=sys.stderr)
+    return count, last_key
+
+
+def _read_rows(path, fmt, columns):
+    # Yields one dict per line of the file without reading the whole file
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _record_error(table, row, known_students):
+    # The reason a row can't be imported or None, workouts get the same checks as workouts.add_workouts_bulk
+    if table == "users":
+        student_id, name, password = row[:3]
+        if student_id is None or not name or not password:
+            return "student_id, name and password are required"
+        return None
+    # (student_id, exercise, reps, weight, is_bodyweight[, datetime]), a missing datetime is filled in by _flush
+    return _row_error(row[1:] if row[6] is not None else row[1:6], known_students)
+
+
+def _flush(table, columns, batch):
+    # Inserts the valid rows of batch ((record number, row) pairs), returns (rows inserted, [(record number, reason)])
+    conn = db.get_connection()
+    known_students = set()
+    if table == "user_workouts":
+        student_ids = list({row[1] for _, row in batch})
+        for i in range(0, len(student_ids), 500): # sqlite limits how many ? a statement can have
+            ids = student_ids[i:i + 500]
+            known_students.update(r[0] for r in conn.execute(f"SELECT student_id FROM users WHERE student_id IN ({', '.join('?' * len(ids))})", ids))
+    errors = [(record_no, _record_error(table, row, known_students)) for record_no, row in batch]
+    rows = [row for (_, row), (_, error) in zip(batch, errors) if error is None]
+    if table == "user_workouts":
+        # stored like workouts.add_workouts_bulk does: lowercase exercise names (every reader looks them up
+        # lowercased) and the current time for workouts without one
+        timestamp = now_text()
+        rows = [(workout_id, student_id, exercise.lower(), reps, weight, is_bodyweight, timestamp if date is None else date)
+                for workout_id, student_id, exercise, reps, weight, is_bodyweight, date in rows]
+    key = TABLES[table][0]
+    with db.transaction() as conn:
+        # rows whose key is already there are skipped so running the same import again is harmless,
+        # any other constraint or trigger failure still raises
+        cursor = conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) ON CONFLICT({key}) DO NOTHING", rows)
+    # rowcount only counts the rows this statement inserted (total_changes would add the rollup triggers' writes)
+    return cursor.rowcount, [(record_no, error) for record_no, error in errors if error is not None]
+
+
+def import_table(table, path, fmt=None, batch_size=BATCH_SIZE, after_id=0):
+    # Loads rows from path into the table keeping their keys, returns (rows imported, rows rejected, last key committed)
+    # Rows that are already in the table aren't counted as imported
+    key, columns, types = TABLES[table]
+    fmt = _file_format(path, fmt)
+    batch, count, rejected, last_key, started = [], 0, 0, after_id, time.perf_counter()
+
+    def flush():
+        nonlocal count, rejected, last_key
+        inserted, errors = _flush(table, columns, batch)
+        for record_no, error in errors:
+            print(f"\nSkipping record {record_no}: {error}", file=sys.stderr)
+        count += inserted
+        rejected += len(errors)
+        last_key = batch[-1][1][0]
+        batch.clear()
+        _progress("imported", table, count, last_key, started)
+
+    # records are numbered from 1 after the CSV header (a quoted field can span lines, so they aren't line numbers)
+    for record_no, record in enumerate(_read_rows(path, fmt, columns), start=1):
+        try:
+            # empty optional values (like a missing house) are stored as NULL
+            row = tuple(None if record.get(col) in (None, "") else kind(record[col]) for col, kind in zip(columns, types))
+        except (TypeError, ValueError) as e:
+            print(f"\nSkipping record {record_no}: {e}", file=sys.stderr)
+            rejected += 1
+            continue
+        if row[0] is not None and row[0] <= after_id:
+            continue # already imported by an earlier run
+        batch.append((record_no, row))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    print(file=sys.stderr)
+    return count, rejected, last_key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream fitness.db tables to and from CSV or JSONL")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("table", choices=list(TABLES))
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--db", help="database file (defaults to fitness.db)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--after-id", type=int, default=0, help="only rows with a key above this, used to resume")
+    parser.add_argument("--student-id", type=int)
+    parser.add_argument("--exercise")
+    parser.add_argument("--since", help="export workouts on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", help="export workouts before this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(args.db)
+    if args.action == "export":
+        count, last_key = export_table(args.table, args.path, args.format, args.batch_size, args.after_id, student_id=args.student_id, exercise=args.exercise, since=args.since, until=args.until)
+        print(f"exported {count} rows, resume with --after-id {last_key}")
+    else:
+        count, rejected, last_key = import_table(args.table, args.path, args.format, args.batch_size, args.after_id)
+        print(f"imported {count} rows ({rejected} rejected), resume with --after-id {last_key}")
+
+
+if __name__ == "__main__":
+    main()
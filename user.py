@@ -1,5 +1,5 @@
-import sqlite3
-import hashlib # most things here are commented on in my GUI
+import hashlib
+from db import get_connection, transaction, workouts_changed # most things here are commented on in my GUI
 # Validate Password
 def is_valid_password(passowrd):
     return len(passowrd) >= 8 # Checks if password is more than or equal to 8 characters
@@ -20,21 +20,18 @@ def add_user(name, house, student_id, password, exercise="none"):
     student_id = int(student_id)
     hashed_pw = hash_password(password)
 
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    with transaction() as conn:
+        cursor = conn.cursor()
  
-    # checks for duplicates of student_id
-    cursor.execute("SELECT 1 FROM user_workouts WHERE student_id = ?", (student_id,))
-    if cursor.fetchone():
-        print("Error: Student ID already exists.")
-        conn.close()
-        return
+        # checks for duplicates of student_id
+        cursor.execute("SELECT 1 FROM users WHERE student_id = ?", (student_id,))
+        if cursor.fetchone():
+            print("Error: Student ID already exists.")
+            return
     
-    # insert placeholder row to store identity
-    cursor.execute("INSERT INTO user_workouts (name, house, student_id, password, exercise, reps, weight, is_bodyweight)  VALUES (?, ?, ?, ?, ?, ?, ?, ?) ", (name, house, student_id, hashed_pw, exercise, 0, 0.0, 1))
+        # stores the identity in the users table (house is added by migration 3 in migrations.py)
+        cursor.execute("INSERT INTO users (name, house, student_id, password)  VALUES (?, ?, ?, ?) ", (name, house, student_id, hashed_pw))
 
-    conn.commit()
-    conn.close()
     print("user registered successfully.")
 
     # Authenticate User login
@@ -46,12 +43,10 @@ def add_user(name, house, student_id, password, exercise="none"):
         student_id = int(student_id)
         hashed_pw = hash_password(password)
 
-        conn = sqlite3.connect("fitness.db")
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
 
-        cursor.execute("SELECT name FROM user_workouts WHERE student_id = ? AND password = ?  LIMIT 1", (student_id, hashed_pw))
+        cursor.execute("SELECT name FROM users WHERE student_id = ? AND password = ?  LIMIT 1", (student_id, hashed_pw))
         result = cursor.fetchone()
-        conn.close()
 
         if result:
             name = result[0]
@@ -67,12 +62,10 @@ def get_user_info(student_id):
         return None
     
     student_id = int(student_id)
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
 
-    cursor.execute("SELECT name, house, password FROM user_workouts WHERE student_id = ? LIMIT 1", (student_id))
+    cursor.execute("SELECT name, house, password FROM users WHERE student_id = ? LIMIT 1", (student_id,))
     result = cursor.fetchone()
-    conn.close()
     
     if result:
         return {
@@ -91,29 +84,24 @@ def delete_user(student_id):
         return
     
     student_id = int(student_id)
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    with transaction() as conn:
+        cursor = conn.cursor()
     
-    cursor.execute("SELECT COUNT(*) FROM user_workouts WHERE student_id = ?", (student_id,))
-    count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM users WHERE student_id = ?", (student_id,))
+        count = cursor.fetchone()[0]
 
-    if count == 0:
-        print("Errror: no user found with that student ID.")
-        conn.close()
-        return
+        if count == 0:
+            print("Errror: no user found with that student ID.")
+            return
     
-    cursor.execute("DELETE FROM user_workouts WHERE student_id = ?", (student_id,))
-    cursor.execute("DELETE FROM user_goals WHERE student_id = ?", (student_id,))
+        # user_workouts and user_goals rows are removed by ON DELETE CASCADE
+        cursor.execute("DELETE FROM users WHERE student_id = ?", (student_id,))
 
-    conn.commit()
-    conn.close()
+    workouts_changed(student_id)
     print(f" User '{student_id}' and all related data deleted.")
 
     # Update a user
 def update_user(student_id, new_name=None, new_house=None, new_password=None):
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-
     fields = []
     values = []
 
@@ -129,21 +117,16 @@ def update_user(student_id, new_name=None, new_house=None, new_password=None):
 
     if not fields:
         print("error: No fields tto update")
-        conn.close()
         return
     values.append(student_id)
-    query =  f"UPDATE user_workouts SET {', '.join(fields)} WHERE student_id = ?"
+    query =  f"UPDATE users SET {', '.join(fields)} WHERE student_id = ?"
 
-    cursor.execute(query, values)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(query, values)
     print(f"user {student_id} profile updated.")
 
     # Updated latest workout for a specific exercise
     def update_exercise(student_id, exercise, new_reps=None, new_weight=None):
-        conn = sqlite3.connect("fitness.db")
-        cursor = conn.cursor()
-
         fields = []
         values = []
 
@@ -155,15 +138,14 @@ def update_user(student_id, new_name=None, new_house=None, new_password=None):
             values.append(new_weight)
         if not fields:
             print("Error : no exercise fields to update")
-            conn.close()
             return
         
         values.append(student_id)
         values.append(exercise)
         query = f"UPDATE user_workouts SET {', '.join(fields)} WHERE student_id = ? AND exercise = ?"
         
-        cursor.execute(query, values)
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute(query, values)
+        workouts_changed(student_id, exercise)
         print(f"Updated latest {exercise} Workout for use {student_id}.")
 
@@ -0,0 +1,51 @@
+from collections import namedtuple
+import numpy as np
+from db import get_connection
+from timestamps import DAY
+
+# Columnar reads of one student's history for one exercise
+# The rows are fetched in chunks of FETCH_SIZE and copied straight into preallocated NumPy arrays, so a long
+# history never exists as one Python tuple per workout; the query is answered from idx_workouts_series alone
+
+FETCH_SIZE = 10000 # rows converted at a time
+
+# ts: epoch seconds, day: whole days since the first workout, then reps, weight and is_bodyweight
+# every field is a contiguous array with one value per workout, oldest first
+WorkoutSeries = namedtuple("WorkoutSeries", ["ts", "day", "reps", "weight", "is_bodyweight"])
+
+# Both read from idx_workouts_series (database.hot_queries checks their plans)
+COUNT_QUERY = "SELECT COUNT(*) FROM user_workouts WHERE student_id = ? AND exercise = ?"
+SERIES_QUERY = "SELECT ts, reps, weight, is_bodyweight FROM user_workouts WHERE student_id = ? AND exercise = ? ORDER BY datetime ASC"
+
+ROW_DTYPE = np.dtype([("ts", np.int64), ("reps", np.int64), ("weight", np.float64), ("is_bodyweight", np.bool_)])
+
+
+def _grow(array, size, needed):
+    # Copies the first size values into a bigger array (at least double) with room for needed values
+    bigger = np.empty(max(2 * len(array), needed), dtype=array.dtype)
+    bigger[:size] = array[:size]
+    return bigger
+
+
+def fetch_series(student_id, exercise, fetch_size=FETCH_SIZE):
+    # Returns a WorkoutSeries for the student and exercise (empty arrays if there are no workouts)
+    conn = get_connection()
+    params = (student_id, exercise.lower())
+    # the count (from the same index) sizes the arrays, they still grow if workouts are added in between
+    capacity = conn.execute(COUNT_QUERY, params).fetchone()[0]
+    columns = {name: np.empty(capacity, dtype=ROW_DTYPE[name]) for name in ROW_DTYPE.names}
+    cursor = conn.execute(SERIES_QUERY, params)
+    size = 0
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        block = np.array(rows, dtype=ROW_DTYPE) # only this chunk is ever held as tuples
+        end = size + len(rows)
+        for name, column in columns.items():
+            if end > len(column):
+                column = columns[name] = _grow(column, size, end)
+            column[size:end] = block[name]
+        size = end
+    ts, reps, weight, is_bodyweight = (columns[name][:size] for name in ROW_DTYPE.names)
+    return WorkoutSeries(ts, (ts - ts[:1]) // DAY, reps, weight, is_bodyweight)
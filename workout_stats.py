@@ -0,0 +1,166 @@
+import db
+from db import get_connection, transaction
+
+# Running sums for every (student_id, exercise) so a prediction can be made without reading the workouts
+# For x = whole days since the first workout the table keeps n, the power sums sum(x^k) for k = 1..4 and
+# sum(x^k * reps), sum(x^k * weight) for k = 0..2, which is everything the degree 2 normal equations need,
+# plus the first workout time (anchor), the latest workout and the min/max reps and weight for the CI
+# Triggers on user_workouts update the sums when a workout is inserted and take it back out when one is deleted
+# A change that can't be applied in O(1) (a workout earlier than the first one, deleting the first or
+# latest workout or a min/max value) marks the row dirty and it is rebuilt from the workouts the next time it is read
+
+STATS_DEGREE = 2 # highest polynomial degree the stored sums support
+POWER_SUMS = [f"sx{k}" for k in range(1, 2 * STATS_DEGREE + 1)]
+REPS_SUMS = [f"sr{k}" for k in range(STATS_DEGREE + 1)]
+WEIGHT_SUMS = [f"sw{k}" for k in range(STATS_DEGREE + 1)]
+
+CREATE_TABLE = f"""
+    CREATE TABLE IF NOT EXISTS workout_stats (
+       student_id INTEGER NOT NULL,
+       exercise TEXT NOT NULL,
+       anchor INTEGER NOT NULL,
+       n INTEGER NOT NULL,
+       last_day INTEGER NOT NULL,
+       {' INTEGER NOT NULL, '.join(POWER_SUMS)} INTEGER NOT NULL,
+       {' REAL NOT NULL, '.join(REPS_SUMS + WEIGHT_SUMS)} REAL NOT NULL,
+       min_reps INTEGER, max_reps INTEGER, min_weight REAL, max_weight REAL,
+       last_at TEXT, last_reps INTEGER, last_weight REAL,
+       dirty INTEGER NOT NULL DEFAULT 0,
+       PRIMARY KEY (student_id, exercise)
+    ) WITHOUT ROWID
+"""
+
+
+def _seconds(row):
+    return f"CAST(strftime('%s', {row}.datetime) AS INTEGER)"
+
+
+def _x(row):
+    # whole days between the workout and the series' first workout, the same as (d - dates[0]).days
+    return f"(({_seconds(row)} - anchor) / 86400)"
+
+
+def _power(expression, k):
+    return " * ".join([expression] * k) if k else "1"
+
+
+def _add_sql(row, sign):
+    # SET clauses that add (sign "+") or take away (sign "-") one workout from the sums
+    x = _x(row)
+    sets = [f"n = n {sign} 1"]
+    sets += [f"sx{k} = sx{k} {sign} {_power(x, k)}" for k in range(1, 2 * STATS_DEGREE + 1)]
+    sets += [f"sr{k} = sr{k} {sign} {_power(x, k)} * {row}.reps" for k in range(STATS_DEGREE + 1)]
+    sets += [f"sw{k} = sw{k} {sign} {_power(x, k)} * {row}.weight" for k in range(STATS_DEGREE + 1)]
+    return ", ".join(sets)
+
+
+def _insert_sql(row):
+    # Statements that apply an inserted workout to its series' sums
+    where = f"student_id = {row}.student_id AND exercise = {row}.exercise"
+    return f"""
+        INSERT OR IGNORE INTO workout_stats (student_id, exercise, anchor, n, last_day, {', '.join(POWER_SUMS + REPS_SUMS + WEIGHT_SUMS)}, min_reps, max_reps, min_weight, max_weight, last_at, last_reps, last_weight)
+        VALUES ({row}.student_id, {row}.exercise, {_seconds(row)}, 0, 0, {', '.join(['0'] * (len(POWER_SUMS) + len(REPS_SUMS) + len(WEIGHT_SUMS)))}, {row}.reps, {row}.reps, {row}.weight, {row}.weight, {row}.datetime, {row}.reps, {row}.weight);
+        UPDATE workout_stats SET
+            dirty = dirty OR (n > 0 AND ({_x(row)} < 0 OR {row}.datetime = last_at)),
+            {_add_sql(row, '+')},
+            last_day = MAX(last_day, {_x(row)}),
+            min_reps = MIN(min_reps, {row}.reps), max_reps = MAX(max_reps, {row}.reps),
+            min_weight = MIN(min_weight, {row}.weight), max_weight = MAX(max_weight, {row}.weight),
+            last_reps = CASE WHEN {row}.datetime > last_at THEN {row}.reps ELSE last_reps END,
+            last_weight = CASE WHEN {row}.datetime > last_at THEN {row}.weight ELSE last_weight END,
+            last_at = MAX(last_at, {row}.datetime)
+        WHERE {where};
+    """
+
+
+def _delete_sql(row):
+    # Statements that take a deleted workout back out of its series' sums
+    where = f"student_id = {row}.student_id AND exercise = {row}.exercise"
+    return f"""
+        UPDATE workout_stats SET
+            dirty = dirty OR {row}.datetime = last_at OR {_seconds(row)} = anchor
+                OR ({row}.reps IN (min_reps, max_reps) AND min_reps <> max_reps)
+                OR ({row}.weight IN (min_weight, max_weight) AND min_weight <> max_weight),
+            {_add_sql(row, '-')}
+        WHERE {where};
+        DELETE FROM workout_stats WHERE {where} AND n <= 0;
+    """
+
+
+TRIGGERS = {
+    "trg_stats_insert": f"AFTER INSERT ON user_workouts BEGIN {_insert_sql('NEW')} END",
+    "trg_stats_delete": f"AFTER DELETE ON user_workouts BEGIN {_delete_sql('OLD')} END",
+    "trg_stats_update": f"AFTER UPDATE OF student_id, exercise, reps, weight, datetime ON user_workouts BEGIN {_delete_sql('OLD')} {_insert_sql('NEW')} END",
+}
+
+
+def create_stats_schema(conn):
+    conn.execute(CREATE_TABLE)
+    for name, body in TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+
+def rebuild_stats(student_id=None, exercise=None):
+    # Recomputes the sums from user_workouts for one series, one student or (with no arguments) everything
+    filters, params = [], []
+    if student_id is not None:
+        filters.append("student_id = ?")
+        params.append(student_id)
+    if exercise is not None:
+        filters.append("exercise = ?")
+        params.append(exercise)
+    where = (" WHERE " + " AND ".join(filters)) if filters else ""
+    x = "((CAST(strftime('%s', w.datetime) AS INTEGER) - a.anchor) / 86400)"
+    columns = ["n", "last_day"] + POWER_SUMS + REPS_SUMS + WEIGHT_SUMS
+    sums = ["COUNT(*)", f"MAX({x})"]
+    # TOTAL adds up as floats, SUM would fail with integer overflow once sum(x^4) passes 2^63 on a long history
+    sums += [f"TOTAL({_power(x, k)})" for k in range(1, 2 * STATS_DEGREE + 1)]
+    sums += [f"TOTAL({_power(x, k)} * w.reps)" for k in range(STATS_DEGREE + 1)]
+    sums += [f"TOTAL({_power(x, k)} * w.weight)" for k in range(STATS_DEGREE + 1)]
+    # the latest workout is the last row in the same order get_workout_data reads them
+    latest = "FROM user_workouts l WHERE l.student_id = a.student_id AND l.exercise = a.exercise ORDER BY l.datetime DESC, l.reps DESC, l.weight DESC LIMIT 1"
+    query = f"""
+        WITH a AS (
+            SELECT student_id, exercise, MIN(CAST(strftime('%s', datetime) AS INTEGER)) AS anchor
+            FROM user_workouts{where} GROUP BY student_id, exercise
+        )
+        INSERT INTO workout_stats (student_id, exercise, anchor, {', '.join(columns)}, min_reps, max_reps, min_weight, max_weight, last_at, last_reps, last_weight, dirty)
+        SELECT a.student_id, a.exercise, a.anchor, {', '.join(sums)},
+               MIN(w.reps), MAX(w.reps), MIN(w.weight), MAX(w.weight),
+               MAX(w.datetime), (SELECT l.reps {latest}), (SELECT l.weight {latest}), 0
+        FROM a JOIN user_workouts w ON w.student_id = a.student_id AND w.exercise = a.exercise
+        GROUP BY a.student_id, a.exercise
+    """
+    with transaction() as conn:
+        conn.execute("DELETE FROM workout_stats" + where, params)
+        conn.execute(query, params)
+
+
+def get_stats(student_id, exercise):
+    # Returns the stats row for a series as a dict (rebuilding it first if it is dirty) or None if there are no workouts
+    # A read-only connection can't rebuild, so there the row comes back with dirty set and the caller must not trust the sums
+    conn = get_connection()
+    cursor = conn.execute("SELECT * FROM workout_stats WHERE student_id = ? AND exercise = ?", (student_id, exercise))
+    row = cursor.fetchone()
+    if row is not None and row[-1] and not db.READ_ONLY:
+        rebuild_stats(student_id, exercise)
+        cursor = conn.execute("SELECT * FROM workout_stats WHERE student_id = ? AND exercise = ?", (student_id, exercise))
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in cursor.description], row))
+
+
+EXERCISES_QUERY = "SELECT exercise FROM workout_stats WHERE student_id = ? ORDER BY exercise"
+
+
+def get_exercises(student_id):
+    # The exercises a student has logged, alphabetically (one workout_stats row per exercise, read from its primary key)
+    cursor = get_connection().execute(EXERCISES_QUERY, (student_id,))
+    return [exercise for (exercise,) in cursor.fetchall()]
+
+
+def has_exercise(student_id, exercise):
+    # False once the student's last workout of this exercise is deleted (the trigger removes the row)
+    cursor = get_connection().execute("SELECT 1 FROM workout_stats WHERE student_id = ? AND exercise = ?", (student_id, exercise))
+    return cursor.fetchone() is not None
@@ -0,0 +1,95 @@
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from db import transaction, workouts_changed, close_connection
+from timestamps import epoch_sql
+
+# Write-behind queue for logged workouts
+# log() returns straight away with a Future; a background thread collects what is queued for up to FLUSH_MS
+# (or MAX_ROWS workouts) and inserts it all in one transaction, so a burst of logging costs one commit (and
+# one fsync) per batch instead of one per workout
+# Every workout gets its own savepoint, so a bad row (e.g. its account was deleted meanwhile) fails on its own
+# The Future gets the new workout id once its batch has committed, or the error if it couldn't be written
+# Rows must already be validated (see gui.log_workout), timestamps are the stored Hong Kong time text
+
+FLUSH_MS = 200 # how long the writer waits for more workouts after the first one in a batch
+MAX_ROWS = 500 # a batch is written straight away once it has this many workouts
+
+# ts is worked out in the same statement, like workouts.add_workouts_bulk
+INSERT = f"INSERT INTO user_workouts (student_id, exercise, reps, weight, datetime, is_bodyweight, ts) VALUES (?1, ?2, ?3, ?4, ?5, ?6, {epoch_sql('?5')}) RETURNING id"
+
+_STOP = object()
+
+
+class WorkoutWriter:
+    def __init__(self, flush_ms=FLUSH_MS, max_rows=MAX_ROWS):
+        self.flush_ms = flush_ms
+        self.max_rows = max_rows
+        self.queue = queue.Queue() # (row, future) or _STOP
+        self.batches = 0 # number of committed batches
+        self.thread = threading.Thread(target=self._run, name="workout-writer", daemon=True)
+        self.thread.start()
+
+    def log(self, student_id, exercise, reps, weight, is_bodyweight, timestamp):
+        # Queues one workout and returns a Future for its id (cancelling the Future before it is written drops it)
+        future = Future()
+        self.queue.put(((student_id, exercise, reps, weight, timestamp, int(is_bodyweight)), future))
+        return future
+
+    def close(self, timeout=None):
+        # Writes everything still queued, then stops the writer thread
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def _next_batch(self):
+        # Waits for a workout, then takes whatever else arrives within flush_ms (up to max_rows)
+        # Returns (batch, stop)
+        item = self.queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.max_rows:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            # workouts whose Future was cancelled while they waited are left out
+            batch = [(row, future) for row, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._write(batch)
+        close_connection()
+
+    def _write(self, batch):
+        results = [] # (future, workout id, error)
+        try:
+            with transaction() as conn:
+                for row, future in batch:
+                    try:
+                        with transaction(): # savepoint, only this row is undone if it fails
+                            results.append((future, conn.execute(INSERT, row).fetchall()[0][0], None))
+                    except sqlite3.Error as e:
+                        results.append((future, None, e))
+        except Exception as e: # the commit failed so nothing in the batch was written
+            for row, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        for student_id, exercise in {(row[0], row[1]) for (row, _), (_, workout_id, _) in zip(batch, results) if workout_id}:
+            workouts_changed(student_id, exercise)
+        for future, workout_id, error in results:
+            if error is None:
+                future.set_result(workout_id)
+            else:
+                future.set_exception(error)
@@ -1,5 +1,5 @@
-import sqlite3
-from datetime import datetime
+from db import get_connection, transaction, workouts_changed
+from timestamps import now_text, epoch_sql, is_valid_datetime
 # Commented on most things here in the GUI
 # Valid exercises
 valid_exercises = ["situps" , "pushups", "squat", "deadlift", "bench press", "leg press", "pullups", "row", "lateral raises", "plank", "lunge", "bicep curl", "tricep curl"]
@@ -21,25 +21,86 @@ def add_workout(student_id, exercise, reps, weight, is_bodyweight=False):
     if not is_valid_weight(weight):
         return "Invalid weight: must be a positive number"
     
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp = now_text()
 
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO user_workouts (student_id, exercise, reps, weight, datetime, is_bodyweight) VALUES (?, ?, ?, ?, ?, ?)", (student_id, exercise.lower(), reps, weight, timestamp, int(is_bodyweight)))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("INSERT INTO user_workouts (student_id, exercise, reps, weight, datetime, is_bodyweight) VALUES (?, ?, ?, ?, ?, ?)", (student_id, exercise.lower(), reps, weight, timestamp, int(is_bodyweight)))
+    workouts_changed(student_id, exercise.lower())
     return "workout added successfully"
 
+# Bulk import of many workout entries (e.g. a whole season for a school)
+# Each row is (student_id, exercise, reps, weight, is_bodyweight) with an optional timestamp as a 6th value
+BULK_CHUNK_SIZE = 5000 # rows per transaction, one commit (and fsync) per chunk instead of per row
+
+def _row_error(row, known_students):
+    # Uses the same validators as add_workout, returns the reason a row is rejected or None if it is valid
+    if len(row) not in (5, 6):
+        return "Invalid row: expected student_id, exercise, reps, weight, is_bodyweight[, datetime]"
+    student_id, exercise, reps, weight, is_bodyweight = row[:5]
+    if student_id not in known_students:
+        return f"Unknown student ID : {student_id}"
+    if not isinstance(exercise, str) or not is_valid_exercise(exercise):
+        return f"Invalid Exercise : {exercise}"
+    if not is_valid_reps(reps):
+        return "invalid Reps : must be a positive integer"
+    if not is_valid_weight(weight):
+        return "Invalid weight: must be a positive number"
+    if is_bodyweight not in (0, 1):
+        return "Invalid is_bodyweight: must be 1 (True) or 0 (False)"
+    if len(row) == 6 and not is_valid_datetime(row[5]):
+        return f"Invalid datetime : {row[5]} (must be YYYY-MM-DD HH:MM:SS)"
+    return None
+
+def add_workouts_bulk(rows, chunk_size=BULK_CHUNK_SIZE):
+    # Validates every row first, then inserts the valid ones with executemany in chunked transactions
+    # Returns (number inserted, list of (row index, reason) for every rejected row)
+    rows = [tuple(row) for row in rows]
+    timestamp = now_text() # used for rows that don't bring their own
+
+    # one query for all the student IDs instead of letting a foreign key error abort a whole chunk
+    student_ids = list({row[0] for row in rows if row})
+    known_students = set()
+    conn = get_connection()
+    for i in range(0, len(student_ids), 500): # sqlite limits how many ? a statement can have
+        batch = student_ids[i:i + 500]
+        cursor = conn.execute(f"SELECT student_id FROM users WHERE student_id IN ({', '.join('?' * len(batch))})", batch)
+        known_students.update(r[0] for r in cursor)
+
+    errors = [_row_error(row, known_students) for row in rows]
+    rejected = [(i, error) for i, error in enumerate(errors) if error is not None]
+    valid = [(row[0], row[1].lower(), row[2], row[3], row[5] if len(row) == 6 else timestamp, int(row[4])) for row, error in zip(rows, errors) if error is None]
+
+    for i in range(0, len(valid), chunk_size):
+        with transaction() as conn:
+            # ts is worked out in the same statement so the ts trigger doesn't have to update every row again
+            conn.executemany(f"INSERT INTO user_workouts (student_id, exercise, reps, weight, datetime, is_bodyweight, ts) VALUES (?1, ?2, ?3, ?4, ?5, ?6, {epoch_sql('?5')})", valid[i:i + chunk_size])
+    for student_id, exercise in {(row[0], row[1]) for row in valid}:
+        workouts_changed(student_id, exercise)
+    return len(valid), rejected
+
 def get_workouts(student_id):
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    conn = get_connection()
 
-    cursor.execute("SELECT id, exercise, reps, weight, datetime, is_bodyweight FROM user_workouts WHERE student_id = ? ORDER BY datetime Asc", (student_id))   
+    cursor = conn.execute("SELECT id, exercise, reps, weight, datetime, is_bodyweight FROM user_workouts WHERE student_id = ? ORDER BY datetime Asc", (student_id,))   
 
     results = cursor.fetchall()
-    conn.close()
     return results
 
+# One page of a student's workout history, oldest first, for the history table
+# Keyset pagination: after is the (datetime, id) of the last row already shown, so every page is an index
+# seek no matter how far down it is (OFFSET would have to step over all the rows before it)
+HISTORY_PAGE_SIZE = 200
+FIRST_PAGE_QUERY = "SELECT id, datetime, exercise, reps, weight, is_bodyweight FROM user_workouts WHERE student_id = ? ORDER BY datetime, id LIMIT ?"
+NEXT_PAGE_QUERY = "SELECT id, datetime, exercise, reps, weight, is_bodyweight FROM user_workouts WHERE student_id = ? AND (datetime, id) > (?, ?) ORDER BY datetime, id LIMIT ?"
+
+def get_workout_page(student_id, after=None, limit=HISTORY_PAGE_SIZE):
+    conn = get_connection()
+    if after is None:
+        cursor = conn.execute(FIRST_PAGE_QUERY, (student_id, limit))
+    else:
+        cursor = conn.execute(NEXT_PAGE_QUERY, (student_id, after[0], after[1], limit))
+    return cursor.fetchall()
+
 # update workout entry
 def update_workout(workout_id, exercise, reps, weight, is_bodyweight):
     if not is_valid_exercise(exercise):
@@ -49,41 +110,36 @@ def update_workout(workout_id, exercise, reps, weight, is_bodyweight):
     if not is_valid_weight(weight):
         return "Invalid weight: must be a positive number"
     
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-    cursor.execute(""" SELECT 1 FROM user_workouts WHERE id = ?""", (workout_id))
-    if not cursor.fetchone():
-        conn.close()
-        return " No workout found with ID {workout_id}"
+    with transaction() as conn:
+        cursor = conn.execute(""" SELECT student_id, exercise FROM user_workouts WHERE id = ?""", (workout_id,))
+        old = cursor.fetchone()
+        if not old:
+            return " No workout found with ID {workout_id}"
     
-    cursor.execute("UPDATE user_workouts SET exercise = ?, reps = ?, weight = ?, is_bodyweight = ? WHERE id = ?", (exercise.lower(), reps, weight, int(is_bodyweight), workout_id))
-    conn.commit()
-    conn.close()
+        conn.execute("UPDATE user_workouts SET exercise = ?, reps = ?, weight = ?, is_bodyweight = ? WHERE id = ?", (exercise.lower(), reps, weight, int(is_bodyweight), workout_id))
+    # both the old and the new exercise series have changed
+    workouts_changed(old[0], old[1])
+    workouts_changed(old[0], exercise.lower())
     return "workout updated successfully"
 
 # Delete workout entry
 def delete_workout(workout_id):
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT 1 FROM user_workouts WHERE id = ?", (workout_id))
-    if not cursor.fetchone():
-        conn.close()
-        return f"No workout found with ID {workout_id}"
+    with transaction() as conn:
+        cursor = conn.execute("SELECT student_id, exercise FROM user_workouts WHERE id = ?", (workout_id,))
+        old = cursor.fetchone()
+        if not old:
+            return f"No workout found with ID {workout_id}"
     
-    cursor.execute("DELETE FROM user_workouts WHERE id = ?", (workout_id))
-    conn.commit()
-    conn.close()
+        conn.execute("DELETE FROM user_workouts WHERE id = ?", (workout_id,))
+    workouts_changed(old[0], old[1])
     return "workout entrry {workout_id} deleted successfully"
 
 # retrieve workouts for a user
 def get_workouts(student_id, exercise):
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
+    conn = get_connection()
 
-    cursor.execute("SELECT id, exercise, reps, weight, datetime, is_bodyweight FROM user_workouts WHERE student_id = ? AND exercise = ? ORDER BY datetime ASC", (student_id, exercise.lower()))
+    cursor = conn.execute("SELECT id, exercise, reps, weight, datetime, is_bodyweight FROM user_workouts WHERE student_id = ? AND exercise = ? ORDER BY datetime ASC", (student_id, exercise.lower()))
     results = cursor.fetchall()
-    conn.close()
     return results
 
 